@@ -0,0 +1,204 @@
+from excel.xlsx_io import Person, iter_persons
+from excel.results_writer import ResultsWriter
+
+from scraper.scraper import search_inn_, is_throttling_error, NalogRuClient, OGUClient
+from scraper.scheduler import SearchScheduler
+from scraper.session import SessionManager
+from scraper.strategy import ProviderStrategy, StrategyMode
+from scraper.rate_limiter import AdaptiveRateLimiter
+from scraper.single_flight import SingleFlight
+from scraper.captcha import CaptchaPool
+from scraper.mock_server import LatencyModel, MockProviderConfig, MockProviderServer
+from scraper.metrics import METRICS, quantile
+import asyncio
+
+from log import InnSearcherLogger
+
+import psutil
+
+from argparse import ArgumentParser, Namespace
+from functools import partial
+import json
+import os
+import random
+import tempfile
+import time
+from contextlib import AsyncExitStack
+
+from typing import AsyncIterator
+
+
+_LAST_NAMES = ('Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев')
+_FIRST_NAMES = ('Иван', 'Петр', 'Сергей', 'Андрей', 'Алексей', 'Дмитрий', 'Николай', 'Олег')
+_PATRONYMICS = ('Иванович', 'Петрович', 'Сергеевич', 'Андреевич', '')
+
+
+def _parse_args() -> Namespace:
+	parser = ArgumentParser(description='Benchmark the INN search pipeline against a local mock of nalog.ru and OGU')
+	parser.add_argument('-n', '--persons', type=int, default=2000, help='number of synthetic persons to look up')
+	parser.add_argument('-i', '--input', help='persons table to use instead of synthetic persons')
+	parser.add_argument('-w', '--workers', type=int, default=50, help='number of concurrent lookups')
+	parser.add_argument('-s', '--strategy', choices=[mode.value for mode in StrategyMode], default=StrategyMode.SEQUENTIAL.value,
+	                    help='how nalog.ru and OGU are combined')
+	parser.add_argument('--rate', type=float, default=1000.0, help='initial requests per second allowed per provider')
+	parser.add_argument('--nalog-ru-latency', type=float, default=0.2, help='median nalog.ru response latency, s')
+	parser.add_argument('--ogu-latency', type=float, default=0.3, help='median OGU response latency, s')
+	parser.add_argument('--latency-sigma', type=float, default=0.5, help='log-normal latency spread')
+	parser.add_argument('--error-rate', type=float, default=0.0, help='share of responses failing with HTTP 500')
+	parser.add_argument('--throttling-rate', type=float, default=0.0, help='share of responses failing with HTTP 429')
+	parser.add_argument('--unavailable-rate', type=float, default=0.0, help='share of nalog.ru results with state -1')
+	parser.add_argument('--captcha-rate', type=float, default=0.0, help='share of nalog.ru requests demanding a captcha')
+	parser.add_argument('--not-found-rate', type=float, default=0.1, help='share of persons without INN')
+	parser.add_argument('--report', metavar='FILE', help='JSON file to write the benchmark report to')
+	return parser.parse_args()
+
+
+def _get_synthetic_persons(persons_num: int) -> list[Person]:
+	persons = []
+	for _ in range(persons_num):
+		person = Person()
+		person.last_name = random.choice(_LAST_NAMES)
+		person.first_name = random.choice(_FIRST_NAMES)
+		person.patronymic = random.choice(_PATRONYMICS)
+		person.birthday = f'{random.randint(1, 28):02}.{random.randint(1, 12):02}.{random.randint(1950, 2005)}'
+		person.passport_series = f'{random.randint(0, 9999):04}'
+		person.passport_number = f'{random.randint(0, 999999):06}'
+		persons.append(person)
+
+	return persons
+
+
+class _ResourceSampler:
+	def __init__(self, interval: float = 0.1) -> None:
+		self._process = psutil.Process()
+		self._interval = interval
+		self._sample_task: asyncio.Task | None = None
+
+		self.max_rss = 0
+		self._start_cpu_times = None
+
+	async def __aenter__(self) -> '_ResourceSampler':
+		self._start_cpu_times = self._process.cpu_times()
+		self._sample_task = asyncio.create_task(self._sample())
+		return self
+
+	async def __aexit__(self, *args, **kwargs) -> None:
+		self._sample_task.cancel()
+		await asyncio.gather(self._sample_task, return_exceptions=True)
+		self.max_rss = max(self.max_rss, self._process.memory_info().rss)
+
+	@property
+	def cpu_time(self) -> float:
+		cpu_times = self._process.cpu_times()
+		return cpu_times.user - self._start_cpu_times.user + cpu_times.system - self._start_cpu_times.system
+
+	async def _sample(self) -> None:
+		while True:
+			self.max_rss = max(self.max_rss, self._process.memory_info().rss)
+			await asyncio.sleep(self._interval)
+
+
+async def benchmark(args: Namespace) -> dict:
+	logger = InnSearcherLogger(name='InnSearcherBenchmark')
+	persons = list(iter_persons(input_file=args.input)) if args.input else _get_synthetic_persons(args.persons)
+
+	mock_config = MockProviderConfig(
+		nalog_ru_latency=LatencyModel(median=args.nalog_ru_latency, sigma=args.latency_sigma),
+		ogu_latency=LatencyModel(median=args.ogu_latency, sigma=args.latency_sigma),
+		error_rate=args.error_rate,
+		throttling_rate=args.throttling_rate,
+		unavailable_rate=args.unavailable_rate,
+		captcha_rate=args.captcha_rate,
+		not_found_rate=args.not_found_rate
+	)
+	for client_cls in (NalogRuClient, OGUClient):
+		client_cls.rate_limiter = AdaptiveRateLimiter(
+			name=client_cls.rate_limiter.name, is_throttling_error=is_throttling_error, rate=args.rate,
+			max_rate=args.rate * 10, concurrency=args.workers, max_concurrency=args.workers * 10
+		)
+
+	lookup_latencies = []
+
+	async with AsyncExitStack() as exit_stack:
+		mock_server = await exit_stack.enter_async_context(MockProviderServer(config=mock_config))
+		NalogRuClient.base_url = mock_server.nalog_ru_base_url
+		OGUClient.base_url = mock_server.ogu_base_url
+
+		session_manager = await exit_stack.enter_async_context(SessionManager(
+			limit=args.workers * 2, limit_per_host=args.workers * 2, is_ban_error=is_throttling_error
+		))
+		output_dir = exit_stack.enter_context(tempfile.TemporaryDirectory(prefix='inn_benchmark_'))
+		results_writer = await exit_stack.enter_async_context(ResultsWriter(
+			output_excel_file=os.path.join(output_dir, 'results.xlsx')
+		))
+
+		captcha_pool = None
+		if args.captcha_rate > 0:
+			from scraper.captcha_solver.model import CaptchaSolver
+
+			captcha_pool = await exit_stack.enter_async_context(CaptchaPool(
+				session_manager=session_manager,
+				solver=await asyncio.to_thread(CaptchaSolver.load),
+				logger=logger,
+				base_url=NalogRuClient.base_url
+			))
+
+		search = partial(
+			search_inn_,
+			session_manager=session_manager,
+			provider_strategy=ProviderStrategy(mode=StrategyMode(args.strategy)),
+			logger=logger,
+			results_writer=results_writer,
+			single_flight=SingleFlight(),
+			captcha_pool=captcha_pool
+		)
+
+		async def timed_search(person: Person) -> None:
+			start_time = time.perf_counter()
+			await search(person)
+			lookup_latencies.append(time.perf_counter() - start_time)
+
+		async def aiter_persons() -> AsyncIterator[Person]:
+			for person in persons:
+				yield person
+
+		async with _ResourceSampler() as resource_sampler:
+			start_time = time.perf_counter()
+			await SearchScheduler(search=timed_search, logger=logger, workers_num=args.workers).run(persons=aiter_persons())
+			elapsed_time = time.perf_counter() - start_time
+
+	logger.close()
+
+	lookup_latencies.sort()
+	statuses = METRICS.summary()['counters'].get('persons_total', {})
+	return {
+		'persons': len(persons),
+		'workers': args.workers,
+		'strategy': args.strategy,
+		'elapsed_seconds': elapsed_time,
+		'lookups_per_second': len(lookup_latencies) / elapsed_time if elapsed_time else 0.0,
+		'latency_seconds': {
+			'p50': quantile(lookup_latencies, 0.5),
+			'p95': quantile(lookup_latencies, 0.95),
+			'p99': quantile(lookup_latencies, 0.99),
+			'max': lookup_latencies[-1] if lookup_latencies else 0.0,
+		},
+		'statuses': statuses,
+		'cpu_seconds': resource_sampler.cpu_time,
+		'cpu_utilization': resource_sampler.cpu_time / elapsed_time if elapsed_time else 0.0,
+		'max_rss_mb': resource_sampler.max_rss / 1024 / 1024,
+		'mock_requests': mock_server.requests_num,
+		'metrics': METRICS.summary()['histograms'],
+	}
+
+
+if __name__ == '__main__':
+	cli_args = _parse_args()
+
+	report = asyncio.run(benchmark(args=cli_args))
+	report_json = json.dumps(report, ensure_ascii=False, indent=2)
+	print(report_json)
+
+	if cli_args.report:
+		with open(cli_args.report, 'w', encoding='utf-8') as report_file_obj:
+			report_file_obj.write(report_json)
@@ -0,0 +1,71 @@
+import pandas as pd
+
+from dateutil.parser import parse, ParserError
+
+
+PERSON_COLUMNS = ('last_name', 'first_name', 'patronymic', 'birthday', 'passport_series', 'passport_number')
+
+_DATE_FORMATS = ('%d.%m.%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%y')
+_PASSPORT_LENGTHS = {'passport_series': 4, 'passport_number': 6}
+
+
+def _cell_to_str(value) -> str:
+	if value is None or value != value:
+		return ''
+	if isinstance(value, float) and value.is_integer():
+		return str(int(value))
+	return str(value).strip()
+
+
+def _parse_date(value: str):
+	try:
+		return parse(value, dayfirst=True)
+	except (ParserError, ValueError, OverflowError):
+		return pd.NaT
+
+
+def _normalize_birthdays(birthdays: pd.Series) -> pd.Series:
+	parsed = pd.Series(pd.NaT, index=birthdays.index, dtype='datetime64[ns]')
+	for date_format in _DATE_FORMATS:
+		unparsed = parsed.isna() & (birthdays != '')
+		if not unparsed.any():
+			break
+		parsed[unparsed] = pd.to_datetime(birthdays[unparsed], format=date_format, errors='coerce')
+
+	unparsed = parsed.isna() & (birthdays != '')
+	if unparsed.any():
+		parsed[unparsed] = pd.to_datetime(birthdays[unparsed].map(_parse_date), errors='coerce')
+
+	return parsed.dt.strftime('%d.%m.%Y').fillna('')
+
+
+def normalize_persons(persons_df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+	persons_df = persons_df.reindex(columns=list(PERSON_COLUMNS))
+	cells_df = persons_df.apply(lambda column: column.map(_cell_to_str)).astype(object)
+
+	normalized_df = pd.DataFrame(index=persons_df.index)
+	reasons = pd.Series('', index=persons_df.index, dtype=object)
+
+	def reject(mask: pd.Series, reason: str) -> None:
+		reasons[mask & (reasons == '')] = reason
+
+	for column in ('last_name', 'first_name', 'patronymic'):
+		normalized_df[column] = cells_df[column].str.capitalize()
+	reject(normalized_df['last_name'] == '', 'Не указана фамилия')
+	reject(normalized_df['first_name'] == '', 'Не указано имя')
+
+	normalized_df['birthday'] = _normalize_birthdays(birthdays=cells_df['birthday'])
+	reject(cells_df['birthday'] == '', 'Не указана дата рождения')
+	reject(normalized_df['birthday'] == '', 'Некорректная дата рождения')
+
+	for column, length in _PASSPORT_LENGTHS.items():
+		values = cells_df[column].str.replace(' ', '', regex=False)
+		reject(values == '', 'Не указаны серия или номер паспорта')
+		reject(~values.str.fullmatch(r'\d+') | (values.str.len() > length), 'Некорректные серия или номер паспорта')
+		normalized_df[column] = values.str.zfill(length)
+
+	is_valid = reasons == ''
+	is_rejected = ~is_valid & (cells_df != '').any(axis=1)
+
+	rejects_df = persons_df[is_rejected].assign(reason=reasons[is_rejected])
+	return normalized_df.loc[is_valid, list(PERSON_COLUMNS)], rejects_df
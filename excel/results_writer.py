@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from excel.xlsx_io import Person, export_results
+from scraper.metrics import METRICS
+
+import asyncio
+import csv
+import os
+import time
+
+
+class ResultsWriter:
+	def __init__(self, output_excel_file: str, flush_rows: int = 500, flush_interval: float = 5.0,
+	             overwrite: bool = False) -> None:
+		self._output_excel_file = output_excel_file
+		self._results_file = os.path.splitext(output_excel_file)[0] + '.csv'
+		self._overwrite = overwrite
+
+		self._flush_rows = flush_rows
+		self._flush_interval = flush_interval
+
+		self._queue: asyncio.Queue[Person | None] = asyncio.Queue(maxsize=flush_rows * 4)
+		self._writer_task: asyncio.Task | None = None
+		self._results_file_obj = None
+
+	@property
+	def results_file(self) -> str:
+		return self._results_file
+
+	async def __aenter__(self) -> 'ResultsWriter':
+		self._results_file_obj = await asyncio.to_thread(self._open_results_file)
+		self._writer_task = asyncio.create_task(self._write_results())
+		return self
+
+	async def __aexit__(self, *args, **kwargs) -> None:
+		try:
+			if not self._writer_task.done():
+				await self._put(None)
+			await self._writer_task
+		finally:
+			await asyncio.to_thread(self._results_file_obj.close)
+
+		await asyncio.to_thread(export_results, results_file=self._results_file, output_excel_file=self._output_excel_file)
+
+	async def put(self, checked_person: Person) -> None:
+		await self._put(checked_person)
+
+	async def _put(self, checked_person: Person | None) -> None:
+		self._check_writer_task()
+		if not self._queue.full():
+			self._queue.put_nowait(checked_person)
+			return
+
+		put_task = asyncio.ensure_future(self._queue.put(checked_person))
+		try:
+			done, _ = await asyncio.wait((put_task, self._writer_task), return_when=asyncio.FIRST_COMPLETED)
+		except asyncio.CancelledError:
+			put_task.cancel()
+			raise
+
+		if put_task not in done:
+			put_task.cancel()
+			self._check_writer_task()
+
+	def _check_writer_task(self) -> None:
+		if self._writer_task.done():
+			error = None if self._writer_task.cancelled() else self._writer_task.exception()
+			raise RuntimeError(f'Results writer has stopped: {type(error)} - {error}') from error
+
+	def _open_results_file(self):
+		is_new_file = self._overwrite or not os.path.exists(self._results_file)
+		results_file_obj = open(self._results_file, 'w' if self._overwrite else 'a', newline='', encoding='utf-8')
+		if is_new_file:
+			csv.writer(results_file_obj).writerow(Person().to_json())
+			results_file_obj.flush()
+
+		return results_file_obj
+
+	def _write_rows(self, rows: list[list[str]]) -> None:
+		csv.writer(self._results_file_obj).writerows(rows)
+		self._results_file_obj.flush()
+
+	async def _write_results(self) -> None:
+		rows = []
+		flush_deadline = time.monotonic() + self._flush_interval
+		while True:
+			try:
+				checked_person = await asyncio.wait_for(
+					self._queue.get(), timeout=max(flush_deadline - time.monotonic(), 0)
+				)
+			except asyncio.TimeoutError:
+				checked_person = False
+
+			if checked_person:
+				rows.append(list(checked_person.to_json().values()))
+
+			if checked_person is None or len(rows) >= self._flush_rows or time.monotonic() >= flush_deadline:
+				if rows:
+					with METRICS.time('stage_duration_seconds', stage='result_write'):
+						await asyncio.to_thread(self._write_rows, rows)
+					rows = []
+				flush_deadline = time.monotonic() + self._flush_interval
+
+			if checked_person is None:
+				break
@@ -2,172 +2,362 @@ from openpyxl import load_workbook
 from openpyxl.workbook.workbook import Workbook
 
 import pandas as pd
-from openpyxl.utils.dataframe import dataframe_to_rows
 
-from dateutil.parser import parse, ParserError
-
-from datetime import datetime
+from excel.normalize import PERSON_COLUMNS, normalize_persons
 
 from urllib.parse import urlencode
-from itertools import product
+from hashlib import sha256
+from itertools import chain, islice, product, repeat
+from functools import lru_cache
+
+import csv
+import os
 
+import asyncio
 import threading
 
-_thread_lock = threading.Lock()
+from typing import AsyncIterator, Iterable, Iterator, Optional, Sequence
 
 
-class Person:
-	def __init__(self) -> None:
-		self.last_name: str = ''
-		self.first_name: str = ''
-		self.patronymic: str = ''
-		self.birthday: str = ''
+_JSON_ATTRIBUTES_MAP = {
+	'Фамилия': 'last_name',
+	'Имя': 'first_name',
+	'Отчество': 'patronymic',
+	'Дата рождения': 'birthday',
+	'Серия': 'passport_series',
+	'Номер': 'passport_number',
+	'ИНН': 'inn',
+	'Статус': 'inn_search_status'
+}
+_JSON_COLUMNS = tuple(_JSON_ATTRIBUTES_MAP)
+_PERSON_FIELDS = tuple(_JSON_ATTRIBUTES_MAP.values())
+_IDENTITY_FIELDS = frozenset(_PERSON_FIELDS[:6])
 
-		self.passport_series: str = ''
-		self.passport_number: str = ''
 
-		self.inn: str = ''
-		self.inn_search_status: str = ''
+@lru_cache(maxsize=64)
+def _get_json_attributes_index(json_columns: tuple[str, ...]) -> tuple[tuple[str, str], ...]:
+	return tuple(
+		(json_attr_name, _JSON_ATTRIBUTES_MAP.get(cls_attr_name))
+		for json_attr_name, cls_attr_name in product(json_columns, _JSON_ATTRIBUTES_MAP)
+		if cls_attr_name in json_attr_name
+	)
+
+
+class Person:
+	__slots__ = _PERSON_FIELDS + ('_person_id', '_identity_key', '_ogu_form_data', '_nalog_ru_form_data')
+
+	def __init__(self) -> None:
+		for field in _PERSON_FIELDS:
+			object.__setattr__(self, field, '')
+		self._reset_payloads()
 
-	def process_values(self):
-		self.last_name = self.last_name.strip().capitalize()
-		self.first_name = self.first_name.strip().capitalize()
-		self.patronymic = self.patronymic.strip().capitalize()
+	def __setattr__(self, name: str, value) -> None:
+		object.__setattr__(self, name, value)
+		if name in _IDENTITY_FIELDS:
+			self._reset_payloads()
 
-		if isinstance(self.birthday, datetime):
-			self.birthday = self.birthday.strftime(format='%d.%m.%Y')
-		elif isinstance(self.birthday, (str, int)):
-			date_obj = parse(str(self.birthday))
-			self.birthday = date_obj.strftime(format='%d.%m.%Y')
-		else:
-			raise ParserError('Incorrect birth date format')
+	@classmethod
+	def from_values(cls, values: Iterable[str]) -> 'Person':
+		person = object.__new__(cls)
+		for field, value in zip(_PERSON_FIELDS, chain(values, repeat(''))):
+			object.__setattr__(person, field, value)
+		person._reset_payloads()
+		return person
 
-		self.passport_series = '0' * (4 - len(self.passport_series)) + self.passport_series
-		self.passport_number = '0' * (6 - len(self.passport_number)) + self.passport_number
+	def _reset_payloads(self) -> None:
+		object.__setattr__(self, '_person_id', None)
+		object.__setattr__(self, '_identity_key', None)
+		object.__setattr__(self, '_ogu_form_data', None)
+		object.__setattr__(self, '_nalog_ru_form_data', None)
 
 	@property
 	def person_id(self) -> str:
-		return f'{self.passport_series} {self.passport_number}'
+		if self._person_id is None:
+			object.__setattr__(self, '_person_id', f'{self.passport_series} {self.passport_number}')
+		return self._person_id
+
+	@property
+	def identity_key(self) -> str:
+		if self._identity_key is None:
+			identity = '\x1f'.join((
+				self.last_name, self.first_name, self.patronymic, self.birthday, self.passport_series, self.passport_number
+			))
+			object.__setattr__(self, '_identity_key', sha256(identity.lower().encode('utf-8')).hexdigest())
+		return self._identity_key
 
 	@property
 	def ogu_form_data(self) -> str:
-		return urlencode({
-			'last_name': self.last_name,
-			'first_name': self.first_name,
-			'patronymic': self.patronymic,
-			'birthday': self.birthday,
-			'document_type': '21',
-			'document_value': f'{self.passport_series[:2]} {self.passport_series[2:]} {self.passport_number}'
-		})
+		if self._ogu_form_data is None:
+			object.__setattr__(self, '_ogu_form_data', urlencode({
+				'last_name': self.last_name,
+				'first_name': self.first_name,
+				'patronymic': self.patronymic,
+				'birthday': self.birthday,
+				'document_type': '21',
+				'document_value': f'{self.passport_series[:2]} {self.passport_series[2:]} {self.passport_number}'
+			}))
+		return self._ogu_form_data
 
 	@property
 	def nalog_ru_form_data(self) -> dict[str, str]:
-		search_inn_form = {
-			'c': 'find',
-			'captcha': '',
-			'captchaToken': '',
-			'fam': self.last_name,
-			'nam': self.first_name,
-			'otch': self.patronymic,
-			'opt_otch': '1',
-			'bdate': self.birthday,
-			'doctype': '21',
-			'docno': f'{self.passport_series[:2]} {self.passport_series[2:]} {self.passport_number}',
-			'docdt': '',
-		}
-		key_to_pop = 'opt_otch' if self.patronymic else 'otch'
-		search_inn_form.pop(key_to_pop)
-		return search_inn_form
+		if self._nalog_ru_form_data is None:
+			search_inn_form = {
+				'c': 'find',
+				'captcha': '',
+				'captchaToken': '',
+				'fam': self.last_name,
+				'nam': self.first_name,
+				'otch': self.patronymic,
+				'opt_otch': '1',
+				'bdate': self.birthday,
+				'doctype': '21',
+				'docno': f'{self.passport_series[:2]} {self.passport_series[2:]} {self.passport_number}',
+				'docdt': '',
+			}
+			key_to_pop = 'opt_otch' if self.patronymic else 'otch'
+			search_inn_form.pop(key_to_pop)
+			object.__setattr__(self, '_nalog_ru_form_data', search_inn_form)
+		return self._nalog_ru_form_data
 
 	@classmethod
 	def from_json(cls, person_json: dict[str: str]) -> 'Person':
-		attributes_map = {
-			'Фамилия': 'last_name',
-			'Имя': 'first_name',
-			'Отчество': 'patronymic',
-			'Дата рождения': 'birthday',
-			'Серия': 'passport_series',
-			'Номер': 'passport_number',
-			'ИНН': 'inn',
-			'Статус': 'inn_search_status'
-		}
-
 		person = cls()
-		for json_attr_name, cls_attr_name in product(person_json, attributes_map):
-			if cls_attr_name in json_attr_name:
-				setattr(person, attributes_map.get(cls_attr_name), person_json.get(json_attr_name))
+		for json_attr_name, cls_attr_name in _get_json_attributes_index(tuple(person_json)):
+			setattr(person, cls_attr_name, person_json.get(json_attr_name))
 
 		return person
 
 	def to_json(self) -> dict[str, str]:
-		return {
-			'Фамилия': self.last_name,
-			'Имя': self.first_name,
-			'Отчество': self.patronymic,
-			'Дата рождения': self.birthday,
-			'Серия': self.passport_series,
-			'Номер': self.passport_number,
-			'ИНН': self.inn,
-			'Статус': self.inn_search_status
-		}
+		return dict(zip(_JSON_COLUMNS, (getattr(self, field) for field in _PERSON_FIELDS)))
 
 
-def get_persons_list(input_excel_file: str) -> list[Person]:
-	persons_table_workbook = load_workbook(filename=input_excel_file)
-	persons_table_sheet = persons_table_workbook.active
-
-	header_row = [cell.value for cell in persons_table_sheet[1]]
-
-	attributes_map = {
-		'Фамилия': 'last_name',
-		'Имя': 'first_name',
-		'Отчество': 'patronymic',
-		'Дата рождения': 'birthday',
-		'Серия': 'passport_series',
-		'Номер': 'passport_number'
-	}
-	persons_list = []
-	for row in persons_table_sheet.iter_rows(min_row=2, values_only=True):
-		person = Person()
-		for cell_value, col_name in zip(row, header_row):
-			if col_name:
-				try:
-					attr = next(attr for attr in attributes_map if col_name in attr or attr in col_name)
-				except StopIteration:
-					raise ValueError('Incorrect columns in input excel file')
-
-				setattr(person, attributes_map.get(attr), cell_value if cell_value else '')
-
-		if all(getattr(person, attr) for attr in attributes_map.values() if attr != 'patronymic'):
-			if all(isinstance(getattr(person, attr), str) for attr in attributes_map.values() if attr != 'birthday'):
-				try:
-					person.process_values()
-					persons_list.append(person)
-				except ParserError:
-					pass
+_INPUT_ATTRIBUTES_MAP = {
+	'Фамилия': 'last_name',
+	'Имя': 'first_name',
+	'Отчество': 'patronymic',
+	'Дата рождения': 'birthday',
+	'Серия': 'passport_series',
+	'Номер': 'passport_number'
+}
+_REJECTS_COLUMNS_MAP = {attr: col_name for col_name, attr in _INPUT_ATTRIBUTES_MAP.items()}
+
+
+def _iter_xlsx_rows(input_file: str) -> Iterator[tuple]:
+	persons_table_workbook = load_workbook(filename=input_file, read_only=True, data_only=True)
+	try:
+		yield from persons_table_workbook.active.iter_rows(values_only=True)
+	finally:
+		persons_table_workbook.close()
+
+
+def _iter_csv_rows(input_file: str) -> Iterator[list]:
+	with open(input_file, newline='', encoding='utf-8-sig') as input_file_obj:
+		yield from csv.reader(input_file_obj)
+
+
+def _iter_parquet_rows(input_file: str) -> Iterator[tuple]:
+	try:
+		from pyarrow.parquet import ParquetFile
+	except ImportError:
+		raise ValueError('Parquet input requires pyarrow to be installed')
+
+	parquet_file = ParquetFile(input_file)
+	yield tuple(parquet_file.schema_arrow.names)
+	for batch in parquet_file.iter_batches():
+		yield from zip(*(column.to_pylist() for column in batch.columns))
+
+
+_ROWS_READERS = {
+	'.xlsx': _iter_xlsx_rows,
+	'.csv': _iter_csv_rows,
+	'.parquet': _iter_parquet_rows,
+}
+
+
+def _get_attributes_index(header_row: Iterable) -> dict[int, str]:
+	attributes_index = {}
+	for col_idx, col_name in enumerate(header_row):
+		if col_name:
+			col_name = str(col_name)
+			try:
+				attr = next(attr for attr in _INPUT_ATTRIBUTES_MAP if col_name in attr or attr in col_name)
+			except StopIteration:
+				raise ValueError('Incorrect columns in input file')
+
+			attributes_index[col_idx] = _INPUT_ATTRIBUTES_MAP.get(attr)
+
+	return attributes_index
+
+
+def _iter_persons_dfs(rows: Iterator[Sequence], attributes_index: dict[int, str],
+                      chunk_size: int) -> Iterator[pd.DataFrame]:
+	row_num = 1
+	while True:
+		chunk = list(islice(rows, chunk_size))
+		if not chunk:
+			break
+
+		persons_df = pd.DataFrame({
+			attr: [row[col_idx] if col_idx < len(row) else None for row in chunk]
+			for col_idx, attr in attributes_index.items()
+		}, index=pd.RangeIndex(start=row_num + 1, stop=row_num + 1 + len(chunk)))
+		row_num += len(chunk)
+		yield persons_df
 
+
+def _iter_df_persons(persons_df: pd.DataFrame) -> Iterator[tuple[int, Person]]:
+	for row_idx, *person_values in persons_df.itertuples(name=None):
+		yield row_idx, Person.from_values(person_values)
+
+
+def _get_record_attribute(key: str) -> Optional[str]:
+	if key in _REJECTS_COLUMNS_MAP:
+		return key
+	return next((attr for col_name, attr in _INPUT_ATTRIBUTES_MAP.items() if key and (key in col_name or col_name in key)), None)
+
+
+def normalize_records(records: Sequence) -> tuple[list[tuple[int, Person]], list[tuple[int, str]]]:
+	columns = {attr: [] for attr in PERSON_COLUMNS}
+	records_index = []
+	rejects = []
+	for record_idx, record in enumerate(records):
+		if not isinstance(record, dict):
+			rejects.append((record_idx, 'Некорректная запись'))
+			continue
+
+		record_values = {}
+		for key, value in record.items():
+			attr = _get_record_attribute(key=str(key))
+			if attr:
+				record_values[attr] = value
+		for attr, values in columns.items():
+			values.append(record_values.get(attr))
+		records_index.append(record_idx)
+
+	persons_df, rejects_df = normalize_persons(persons_df=pd.DataFrame(columns, index=records_index))
+	persons = [(int(record_idx), person) for record_idx, person in _iter_df_persons(persons_df=persons_df)]
+	rejects += zip(map(int, rejects_df.index), rejects_df['reason'])
+
+	handled_idxs = set(persons_df.index) | set(rejects_df.index)
+	rejects += [(record_idx, 'Нет данных о человеке') for record_idx in records_index if record_idx not in handled_idxs]
+
+	return persons, sorted(rejects)
+
+
+def _write_rejects(rejects_df: pd.DataFrame, rejects_file: str, write_header: bool) -> None:
+	rejects_df = rejects_df.rename(columns={**_REJECTS_COLUMNS_MAP, 'reason': 'Причина'})
+	rejects_df.to_csv(rejects_file, mode='w' if write_header else 'a', header=write_header,
+	                  index_label='Строка', encoding='utf-8')
+
+
+def iter_persons(input_file: str, rejects_file: Optional[str] = None, chunk_size: int = 10000) -> Iterator[Person]:
+	try:
+		rows_reader = _ROWS_READERS[os.path.splitext(input_file)[1].lower()]
+	except KeyError:
+		raise ValueError(f'Unsupported input file format: {input_file}')
+
+	rows = rows_reader(input_file)
+	header_row = next(rows, None)
+	if header_row is None:
+		raise ValueError('Incorrect input: no person information')
+
+	attributes_index = _get_attributes_index(header_row=header_row)
+	if rejects_file and os.path.exists(rejects_file):
+		os.remove(rejects_file)
+
+	has_rejects = False
+	for persons_df in _iter_persons_dfs(rows=rows, attributes_index=attributes_index, chunk_size=chunk_size):
+		persons_df, rejects_df = normalize_persons(persons_df=persons_df)
+		if rejects_file and not rejects_df.empty:
+			_write_rejects(rejects_df=rejects_df, rejects_file=rejects_file, write_header=not has_rejects)
+			has_rejects = True
+
+		for _, person in _iter_df_persons(persons_df=persons_df):
+			yield person
+
+
+async def aiter_persons(input_file: str, rejects_file: Optional[str] = None, chunk_size: int = 256,
+                        max_chunks: int = 4) -> AsyncIterator[Person]:
+	loop = asyncio.get_running_loop()
+	persons_chunks = asyncio.Queue(maxsize=max_chunks)
+	stop_event = threading.Event()
+
+	def read_persons() -> None:
+		end_marker = None
+		try:
+			chunk = []
+			for person in iter_persons(input_file=input_file, rejects_file=rejects_file):
+				if stop_event.is_set():
+					break
+
+				chunk.append(person)
+				if len(chunk) >= chunk_size:
+					asyncio.run_coroutine_threadsafe(persons_chunks.put(chunk), loop).result()
+					chunk = []
+
+			if chunk and not stop_event.is_set():
+				asyncio.run_coroutine_threadsafe(persons_chunks.put(chunk), loop).result()
+		except Exception as e:
+			end_marker = e
+
+		asyncio.run_coroutine_threadsafe(persons_chunks.put(end_marker), loop).result()
+
+	reader_task = asyncio.create_task(asyncio.to_thread(read_persons))
+	is_finished = False
+	try:
+		while True:
+			chunk = await persons_chunks.get()
+			if not isinstance(chunk, list):
+				is_finished = True
+				if chunk:
+					raise chunk
+				break
+
+			for person in chunk:
+				yield person
+	finally:
+		stop_event.set()
+		while not is_finished:
+			is_finished = not isinstance(await persons_chunks.get(), list)
+		await reader_task
+
+
+def get_persons_list(input_excel_file: str) -> list[Person]:
+	persons_list = list(iter_persons(input_file=input_excel_file))
 	if not persons_list:
 		raise ValueError('Incorrect input: no person information')
 
 	return persons_list
 
 
-def output_results(output_excel_file: str, checked_person: Person) -> None:
-	with _thread_lock:
-		try:
-			wb = load_workbook(filename=output_excel_file)
-			ws = wb.active
-			header = False
-		except FileNotFoundError:
-			wb = Workbook()
-			ws = wb.create_sheet(title='ИНН')
-			header = True
-
-		person_json = checked_person.to_json()
-		for row in dataframe_to_rows(df=pd.json_normalize(data=person_json), index=False, header=header):
+def export_results(results_file: str, output_excel_file: str) -> None:
+	wb = Workbook(write_only=True)
+	ws = wb.create_sheet(title='ИНН')
+
+	with open(results_file, newline='', encoding='utf-8') as results_file_obj:
+		for row in csv.reader(results_file_obj):
 			ws.append(row)
 
-		wb.save(filename=output_excel_file)
+	wb.save(filename=output_excel_file)
+
+
+def merge_results(results_files: Sequence[str], output_excel_file: str) -> str:
+	merged_results_file = os.path.splitext(output_excel_file)[0] + '.csv'
+	with open(merged_results_file, 'w', newline='', encoding='utf-8') as merged_results_file_obj:
+		results_writer = csv.writer(merged_results_file_obj)
+		results_writer.writerow(_JSON_COLUMNS)
+		for results_file in results_files:
+			try:
+				rows_reader = _ROWS_READERS[os.path.splitext(results_file)[1].lower()]
+			except KeyError:
+				raise ValueError(f'Unsupported results file format: {results_file}')
+
+			rows = rows_reader(results_file)
+			next(rows, None)
+			results_writer.writerows(row for row in rows if any(row))
+
+	export_results(results_file=merged_results_file, output_excel_file=output_excel_file)
+	return merged_results_file
 
 
 if __name__ == '__main__':
@@ -1,20 +1,87 @@
 from __future__ import annotations
 
-from logging import Logger, FileHandler, Formatter, INFO
+from logging import Logger, Filter, Formatter, Handler, LogRecord, INFO
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from datetime import datetime
 
+import atexit
+import json
+import os
+import queue
+import random
 
-def _get_file_handler(level: int | str = INFO) -> FileHandler:
-	logs_filename = f'logs/inn_searcher_{datetime.now().strftime(format="%Y-%m-%d_%H-%M-%S")}.log'
-	file_handler = FileHandler(filename=logs_filename, encoding='utf-8')
+
+PAYLOAD_EXTRA = {'payload': True}
+
+
+def _get_file_handler(level: int | str = INFO, max_bytes: int = 50 * 1024 * 1024,
+                      backup_count: int = 10, json_lines: bool = True) -> RotatingFileHandler:
+	logs_filename = f'logs/inn_searcher_{datetime.now().strftime(format="%Y-%m-%d_%H-%M-%S")}_{os.getpid()}.log'
+	os.makedirs(os.path.dirname(logs_filename), exist_ok=True)
+	file_handler = RotatingFileHandler(filename=logs_filename, maxBytes=max_bytes, backupCount=backup_count,
+	                                   encoding='utf-8')
 
 	file_handler.setLevel(level)
-	file_handler.setFormatter(Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+	file_handler.setFormatter(_JsonFormatter() if json_lines else Formatter('%(asctime)s - %(levelname)s - %(message)s'))
 
 	return file_handler
 
 
+class _JsonFormatter(Formatter):
+	def format(self, record: LogRecord) -> str:
+		log_entry = {
+			'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+			'level': record.levelname,
+			'logger': record.name,
+			'message': record.getMessage(),
+		}
+		if getattr(record, 'payload', False):
+			log_entry['payload'] = True
+		if record.exc_info:
+			log_entry['exc_info'] = self.formatException(record.exc_info)
+
+		return json.dumps(log_entry, ensure_ascii=False, default=str)
+
+
+class _PayloadSamplingFilter(Filter):
+	def __init__(self, sample_rate: float) -> None:
+		super().__init__()
+		self._sample_rate = sample_rate
+
+	def filter(self, record: LogRecord) -> bool:
+		return not getattr(record, 'payload', False) or random.random() < self._sample_rate
+
+
+class _LazyQueueHandler(QueueHandler):
+	def prepare(self, record: LogRecord) -> LogRecord:
+		return record
+
+
 class InnSearcherLogger(Logger):
-	def __init__(self, name: str = 'InnSearcher', level: int | str = INFO):
+	def __init__(self, name: str = 'InnSearcher', level: int | str = INFO, async_logging: bool = True,
+	             json_lines: bool = True, payload_sample_rate: float = 0.1, max_bytes: int = 50 * 1024 * 1024,
+	             backup_count: int = 10):
 		Logger.__init__(self, name=name, level=level)
-		self.addHandler(_get_file_handler(level=level))
+
+		file_handler = _get_file_handler(level=level, max_bytes=max_bytes, backup_count=backup_count,
+		                                 json_lines=json_lines)
+		self._file_handler = file_handler
+		self._listener: QueueListener | None = None
+		if async_logging:
+			handler: Handler = _LazyQueueHandler(queue.SimpleQueue())
+			self._listener = QueueListener(handler.queue, file_handler, respect_handler_level=True)
+			self._listener.start()
+			atexit.register(self.close)
+		else:
+			handler = file_handler
+
+		handler.addFilter(_PayloadSamplingFilter(sample_rate=payload_sample_rate))
+		self.addHandler(handler)
+
+	def close(self) -> None:
+		if self._listener:
+			self._listener.stop()
+			self._listener = None
+			atexit.unregister(self.close)
+
+		self._file_handler.close()
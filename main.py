@@ -1,39 +1,366 @@
-from excel.xlsx_io import get_persons_list, output_results
+from excel.xlsx_io import aiter_persons, merge_results
+from excel.results_writer import ResultsWriter
 
-from scraper.scraper import search_inn_
+from scraper.scraper import search_inn_, lookup_person, is_throttling_error, NalogRuClient, OGUClient
+from scraper.scheduler import SearchScheduler
+from scraper.session import SessionManager
+from scraper.strategy import ProviderStrategy, StrategyMode
+from scraper.cache import LookupCache
+from scraper.checkpoint import CheckpointJournal
+from scraper.single_flight import SingleFlight
+from scraper.captcha import CaptchaPool
+from scraper.tor_proxy import TorCircuitPool
+from scraper.proxy_pool import load_proxy_urls
+from scraper.metrics import METRICS, MetricsServer
+from scraper.circuit_breaker import CircuitState
+from scraper.sharding import parse_shard, get_shard_file, split_shard, shard_persons
+from scraper.service import LookupService
 import asyncio
 
 from log import InnSearcherLogger
 
+from argparse import ArgumentParser, Namespace
+from functools import partial
+from typing import Callable, Optional
+import signal
+import os
+import sys
+from contextlib import AsyncExitStack
+
 from datetime import datetime
 
 
 INPUT_FILE = 'excel/input/persons_table.xlsx'
 OUTPUT_FILE = f'excel/output/search_inn_{datetime.now().strftime(format="%Y-%m-%d_%H-%M-%S")}.xlsx'
+WORKERS_NUM = 15
+CACHE_FILE = 'cache/inn_lookups.sqlite'
+
+
+def _parse_args() -> Namespace:
+	parser = ArgumentParser(description='Search persons INN on service.nalog.ru and oplatagosuslug.ru')
+	parser.add_argument('-i', '--input', default=INPUT_FILE, help='input persons table (.xlsx, .csv or .parquet)')
+	parser.add_argument('-o', '--output', default=OUTPUT_FILE, help='output .xlsx file')
+	parser.add_argument('--rejects', metavar='FILE', help='CSV report of input rows rejected by validation')
+	parser.add_argument('-w', '--workers', type=int, default=WORKERS_NUM, help='number of concurrent lookups')
+	parser.add_argument('-s', '--strategy', choices=[mode.value for mode in StrategyMode], default=StrategyMode.SEQUENTIAL.value,
+	                    help='how nalog.ru and OGU are combined: sequential fallback, race or hedged requests')
+	parser.add_argument('--hedge-percentile', type=float, default=0.95,
+	                    help='nalog.ru latency percentile after which OGU is started in hedged mode')
+	parser.add_argument('--cache', default=CACHE_FILE, help='SQLite file with cached lookup results')
+	parser.add_argument('--no-cache', action='store_true', help='always query providers, ignoring the cache')
+	parser.add_argument('--resume', metavar='JOURNAL', help='checkpoint journal of an interrupted run to continue')
+	parser.add_argument('--proxies', metavar='FILE', help='file with one HTTP/SOCKS proxy per line to route lookups through')
+	parser.add_argument('--tor-ports', type=int, nargs='+', metavar='PORT', help='Tor SocksPorts to route lookups through')
+	parser.add_argument('--tor-circuits', type=int, default=4, help='isolated Tor circuits per SocksPort')
+	parser.add_argument('--tor-control-port', type=int, default=9051, help='ControlPort of the Tor process')
+	parser.add_argument('--no-captcha', action='store_true', help='do not solve nalog.ru captchas')
+	parser.add_argument('--captcha-pool-size', type=int, default=2, help='number of pre-solved captchas kept warm')
+	parser.add_argument('--captcha-model', metavar='VARIANT',
+	                    help='captcha model variant (model_variant from configs.yaml by default)')
+	parser.add_argument('--metrics-port', type=int, help='serve Prometheus metrics on 127.0.0.1:PORT/metrics')
+	parser.add_argument('--log-payload-rate', type=float, default=0.1,
+	                    help='share of per-request payload log records that are written (0 - none, 1 - all)')
+	parser.add_argument('--metrics-summary', metavar='FILE', help='JSON file with the final metrics summary')
+	parser.add_argument('--processes', type=int, default=1,
+	                    help='split the input across this many worker processes and merge their results')
+	parser.add_argument('--shard', type=parse_shard, metavar='I/K',
+	                    help='process only the persons of shard I out of K (e.g. one shard per host)')
+	parser.add_argument('--merge', nargs='+', metavar='FILE', help='merge shard results (.csv or .xlsx) into the output and exit')
+	parser.add_argument('--serve', type=int, metavar='PORT',
+	                    help='run as a lookup service with an HTTP API on PORT instead of processing the input file')
+	parser.add_argument('--host', default='127.0.0.1', help='address the lookup service listens on')
+	args = parser.parse_args()
+
+	if args.processes > 1 and (args.shard or args.resume):
+		parser.error('--processes can not be combined with --shard or --resume, resume each shard separately')
+	if args.processes > 1 and args.tor_ports and len(args.tor_ports) < args.processes:
+		parser.error('--processes needs at least one --tor-ports port per process')
+	if args.tor_ports and set(args.tor_ports) & set(range(args.tor_control_port, args.tor_control_port + args.processes)):
+		parser.error('--tor-control-port (offset per process) must not overlap --tor-ports')
+	if args.serve and (args.processes > 1 or args.shard or args.resume or args.merge):
+		parser.error('--serve can not be combined with --processes, --shard, --resume or --merge')
+
+	return args
+
+
+def _add_stop_handlers(stop: Callable[..., None]) -> None:
+	loop = asyncio.get_running_loop()
+	stop_requests = 0
+
+	def request_stop() -> None:
+		nonlocal stop_requests
+		stop_requests += 1
+		stop(drain=stop_requests == 1)
+
+	for sig in (signal.SIGINT, signal.SIGTERM):
+		try:
+			loop.add_signal_handler(sig, request_stop)
+		except (NotImplementedError, RuntimeError):
+			pass
+
+
+def _add_gauges(session_manager: SessionManager, scheduler: Optional[SearchScheduler] = None,
+                service: Optional[LookupService] = None) -> None:
+	if scheduler:
+		METRICS.set_gauge('queue_depth', lambda: scheduler.queue_depth)
+		METRICS.set_gauge('processed_persons', lambda: scheduler.processed_num)
+	if service:
+		METRICS.set_gauge('service_in_flight', lambda: service.in_flight_num)
+		METRICS.set_gauge('processed_persons', lambda: service.processed_num)
+	METRICS.set_gauge('session_exits', lambda: len(session_manager.exits))
+	METRICS.set_gauge('session_in_flight', lambda: sum(session_exit.in_flight for session_exit in session_manager.exits))
+	for client_cls in (NalogRuClient, OGUClient):
+		rate_limiter = client_cls.rate_limiter
+		METRICS.set_gauge('provider_in_flight', lambda rate_limiter=rate_limiter: rate_limiter.in_flight,
+		                  provider=rate_limiter.name)
+		METRICS.set_gauge('provider_concurrency', lambda rate_limiter=rate_limiter: rate_limiter.concurrency,
+		                  provider=rate_limiter.name)
+		METRICS.set_gauge('provider_rate', lambda rate_limiter=rate_limiter: rate_limiter.rate, provider=rate_limiter.name)
+		METRICS.set_gauge('provider_circuit_open',
+		                  lambda circuit_breaker=client_cls.circuit_breaker: int(circuit_breaker.state != CircuitState.CLOSED),
+		                  provider=rate_limiter.name)
 
 
-async def main() -> None:
-	logger = InnSearcherLogger()
+def _get_shard_argv(args: Namespace, shard_index: int) -> list[str]:
+	shard_argv = [
+		'--input', args.input,
+		'--output', get_shard_file(file=args.output, shard_index=shard_index, shards_num=args.processes),
+		'--shard', f'{shard_index}/{args.processes}',
+		'--workers', str(args.workers),
+		'--strategy', args.strategy,
+		'--hedge-percentile', str(args.hedge_percentile),
+		'--cache', args.cache,
+		'--tor-circuits', str(args.tor_circuits),
+		'--captcha-pool-size', str(args.captcha_pool_size),
+		'--log-payload-rate', str(args.log_payload_rate),
+	]
+	if args.captcha_model:
+		shard_argv += ['--captcha-model', args.captcha_model]
+	if args.rejects:
+		shard_argv += ['--rejects', args.rejects]
+	if args.no_cache:
+		shard_argv.append('--no-cache')
+	if args.proxies:
+		shard_argv += ['--proxies', args.proxies]
+	if args.tor_ports:
+		shard_argv += ['--tor-ports', *map(str, args.tor_ports)]
+		shard_argv += ['--tor-control-port', str(args.tor_control_port + shard_index)]
+	if args.no_captcha:
+		shard_argv.append('--no-captcha')
+	if args.metrics_port:
+		shard_argv += ['--metrics-port', str(args.metrics_port + shard_index)]
+	if args.metrics_summary:
+		shard_argv += ['--metrics-summary', get_shard_file(
+			file=args.metrics_summary, shard_index=shard_index, shards_num=args.processes
+		)]
+
+	return shard_argv
+
+
+async def coordinate(args: Namespace) -> None:
+	logger = InnSearcherLogger(name='InnSearcherCoordinator')
+
+	shard_processes = [
+		await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), *_get_shard_argv(args, shard_index))
+		for shard_index in range(args.processes)
+	]
+	logger.info(f'Started {args.processes} shard processes: {[shard_process.pid for shard_process in shard_processes]}')
 
 	try:
-		persons_list = get_persons_list(input_excel_file=INPUT_FILE)
+		returncodes = await asyncio.gather(*(shard_process.wait() for shard_process in shard_processes))
+	finally:
+		for shard_process in shard_processes:
+			if shard_process.returncode is None:
+				shard_process.terminate()
+				await shard_process.wait()
+
+	for shard_index, returncode in enumerate(returncodes):
+		if returncode:
+			logger.error(f'Shard {shard_index}/{args.processes} exited with code {returncode}')
+
+	results_files = [
+		os.path.splitext(get_shard_file(file=args.output, shard_index=shard_index, shards_num=args.processes))[0] + '.csv'
+		for shard_index in range(args.processes)
+	]
+	try:
+		merged_results_file = await asyncio.to_thread(
+			merge_results,
+			results_files=[results_file for results_file in results_files if os.path.exists(results_file)],
+			output_excel_file=args.output
+		)
+		logger.info(f'Merged shard results: {merged_results_file} -> {args.output}')
 	except Exception as e:
-		logger.error(f'Failed to get persons list: {type(e)} - {e}')
-		return
+		logger.error(f'Failed to merge shard results: {type(e)} - {e}')
+
+	logger.close()
+
+
+async def _enter_lookup_resources(exit_stack: AsyncExitStack, args: Namespace,
+                                  logger: InnSearcherLogger) -> tuple[SessionManager, Optional[LookupCache], Optional[CaptchaPool]]:
+	if args.metrics_port:
+		await exit_stack.enter_async_context(MetricsServer(port=args.metrics_port))
+
+	proxy_urls = load_proxy_urls(proxies_file=args.proxies) if args.proxies else []
+	tor_ports = args.tor_ports
+	if args.shard:
+		shard_index, shards_num = args.shard
+		proxy_urls = split_shard(items=proxy_urls, shard_index=shard_index, shards_num=shards_num)
+		tor_ports = tor_ports and split_shard(items=tor_ports, shard_index=shard_index, shards_num=shards_num)
+		logger.info(f'Running shard {shard_index}/{shards_num}')
 
-	search_inn_tasks = [search_inn_(person=person, logger=logger, output_file=OUTPUT_FILE) for person in persons_list]
-	for search_inn_task in asyncio.as_completed(search_inn_tasks):
-		await search_inn_task
+	session_manager = await exit_stack.enter_async_context(SessionManager(
+		proxy_urls=proxy_urls if args.proxies or args.tor_ports else None,
+		limit_per_host=args.workers,
+		is_ban_error=is_throttling_error
+	))
+	if tor_ports:
+		await exit_stack.enter_async_context(TorCircuitPool(
+			logger=logger,
+			socks_ports=tor_ports,
+			circuits_per_port=args.tor_circuits,
+			control_port=args.tor_control_port,
+			on_ready=session_manager.add_exits,
+			on_error=session_manager.fail_exits
+		))
+	lookup_cache = None if args.no_cache else await exit_stack.enter_async_context(LookupCache(
+		cache_file=args.cache,
+		purge_errors=bool(args.resume)
+	))
+
+	captcha_pool = None
+	if not args.no_captcha:
+		from scraper.captcha_solver.model import CaptchaSolver
+
+		captcha_pool = await exit_stack.enter_async_context(CaptchaPool(
+			session_manager=session_manager,
+			solver=await asyncio.to_thread(CaptchaSolver.load, variant=args.captcha_model),
+			logger=logger,
+			pool_size=args.captcha_pool_size,
+			base_url=NalogRuClient.base_url
+		))
+
+	return session_manager, lookup_cache, captcha_pool
+
+
+def _log_run_stats(logger: InnSearcherLogger, metrics_summary_file: str) -> None:
+	for client_cls in (NalogRuClient, OGUClient):
+		logger.info(f'Rate limiter stats ({client_cls.rate_limiter.name}): {client_cls.rate_limiter.stats()}')
+
+	try:
+		METRICS.write_summary(summary_file=metrics_summary_file)
+		logger.info(f'Metrics summary: {metrics_summary_file}')
+	except OSError as e:
+		logger.error(f'Failed to write metrics summary: {type(e)} - {e}')
+
+
+async def serve(args: Namespace) -> None:
+	logger = InnSearcherLogger(payload_sample_rate=args.log_payload_rate)
+
+	async with AsyncExitStack() as exit_stack:
+		session_manager, lookup_cache, captcha_pool = await _enter_lookup_resources(
+			exit_stack=exit_stack, args=args, logger=logger
+		)
+		service = await exit_stack.enter_async_context(LookupService(
+			lookup=partial(
+				lookup_person,
+				session_manager=session_manager,
+				provider_strategy=ProviderStrategy(mode=StrategyMode(args.strategy), hedge_percentile=args.hedge_percentile),
+				logger=logger,
+				lookup_cache=lookup_cache,
+				single_flight=SingleFlight(),
+				captcha_pool=captcha_pool
+			),
+			logger=logger,
+			host=args.host,
+			port=args.serve,
+			max_concurrency=args.workers
+		))
+		_add_stop_handlers(stop=service.stop)
+		_add_gauges(session_manager=session_manager, service=service)
+
+		await service.serve_forever()
+		logger.info(f'Lookup service is stopping: {service.in_flight_num} lookups in flight')
+
+	_log_run_stats(logger=logger, metrics_summary_file=args.metrics_summary or 'logs/service.metrics.json')
+	logger.close()
+
+
+async def main(args: Namespace) -> None:
+	logger = InnSearcherLogger(payload_sample_rate=args.log_payload_rate)
+
+	async with AsyncExitStack() as exit_stack:
+		session_manager, lookup_cache, captcha_pool = await _enter_lookup_resources(
+			exit_stack=exit_stack, args=args, logger=logger
+		)
+		checkpoint = await exit_stack.enter_async_context(CheckpointJournal(
+			journal_file=args.resume or os.path.splitext(args.output)[0] + '.journal.jsonl',
+			resume=bool(args.resume)
+		))
+		if args.resume:
+			logger.info(f'Resuming from {checkpoint.journal_file}: {checkpoint.completed_num} persons completed')
+		results_writer = await exit_stack.enter_async_context(ResultsWriter(
+			output_excel_file=args.output,
+			overwrite=bool(args.resume)
+		))
+
+		scheduler = SearchScheduler(
+			search=partial(
+				search_inn_,
+				session_manager=session_manager,
+				provider_strategy=ProviderStrategy(mode=StrategyMode(args.strategy), hedge_percentile=args.hedge_percentile),
+				logger=logger,
+				results_writer=results_writer,
+				lookup_cache=lookup_cache,
+				checkpoint=checkpoint,
+				single_flight=SingleFlight(),
+				captcha_pool=captcha_pool
+			),
+			logger=logger,
+			workers_num=args.workers
+		)
+		_add_stop_handlers(stop=scheduler.stop)
+		_add_gauges(session_manager=session_manager, scheduler=scheduler)
+
+		rejects_file = args.rejects or os.path.splitext(args.output)[0] + '.rejects.csv'
+		if args.shard and args.shard[0] != 0:
+			rejects_file = None
+
+		try:
+			persons = aiter_persons(input_file=args.input, rejects_file=rejects_file)
+			if args.shard:
+				persons = shard_persons(persons=persons, shard_index=args.shard[0], shards_num=args.shard[1])
+			persons = checkpoint.skip_completed(persons=persons, results_writer=results_writer)
+			await scheduler.run(persons=persons)
+		except Exception as e:
+			logger.error(f'Failed to get persons list: {type(e)} - {e}')
+
+		if not scheduler.processed_num:
+			logger.error('Failed to get persons list: no person information')
+		if rejects_file and os.path.exists(rejects_file):
+			logger.warning(f'Some input rows were rejected, see {rejects_file}')
+
+	_log_run_stats(logger=logger,
+	               metrics_summary_file=args.metrics_summary or os.path.splitext(args.output)[0] + '.metrics.json')
+	logger.close()
 
 
 if __name__ == '__main__':
 	import time
 
+	cli_args = _parse_args()
+
 	print('------------- STARTED -------------')
 	start_time = time.time()
 
 	loop = asyncio.get_event_loop()
-	loop.run_until_complete(main())
+	if cli_args.merge:
+		merge_results(results_files=cli_args.merge, output_excel_file=cli_args.output)
+	elif cli_args.serve:
+		loop.run_until_complete(serve(args=cli_args))
+	elif cli_args.processes > 1:
+		loop.run_until_complete(coordinate(args=cli_args))
+	else:
+		loop.run_until_complete(main(args=cli_args))
 
 	print('------------- FINISHED -------------')
 	print(f'Time: {time.time() - start_time}')
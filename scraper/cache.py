@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from excel.xlsx_io import Person
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sqlite3
+import time
+
+from typing import Optional
+
+
+DAY = 24 * 60 * 60
+
+DEFAULT_TTLS = {
+	'Успешно': 180 * DAY,
+	'ИНН не найден': 7 * DAY,
+	'Ошибка': 10 * 60,
+}
+
+
+class LookupCache:
+	def __init__(self, cache_file: str, ttls: Optional[dict[str, float]] = None, purge_errors: bool = False) -> None:
+		self._cache_file = cache_file
+		self._ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+		self._purge_errors = purge_errors
+
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='lookup-cache')
+		self._connection: sqlite3.Connection | None = None
+
+	async def __aenter__(self) -> 'LookupCache':
+		await self._run(self._connect)
+		return self
+
+	async def __aexit__(self, *args, **kwargs) -> None:
+		await self._run(self._connection.close)
+		self._executor.shutdown(wait=True)
+
+	async def get(self, person: Person) -> Optional[tuple[str, str]]:
+		return await self._run(self._get, person.identity_key)
+
+	async def set(self, person: Person, inn: str, search_status: str) -> None:
+		ttl = self._ttls.get(search_status, 0)
+		if ttl > 0:
+			await self._run(self._set, person.identity_key, inn, search_status, time.time() + ttl)
+
+	async def _run(self, func, *args):
+		return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+	def _connect(self) -> None:
+		cache_dir = os.path.dirname(self._cache_file)
+		if cache_dir:
+			os.makedirs(cache_dir, exist_ok=True)
+
+		self._connection = sqlite3.connect(self._cache_file)
+		self._connection.execute('PRAGMA journal_mode=WAL')
+		self._connection.execute('PRAGMA synchronous=NORMAL')
+		self._connection.execute(
+			'CREATE TABLE IF NOT EXISTS lookups ('
+			'identity_key TEXT PRIMARY KEY, inn TEXT NOT NULL, search_status TEXT NOT NULL, expires_at REAL NOT NULL)'
+		)
+		self._connection.execute('DELETE FROM lookups WHERE expires_at < ?', (time.time(),))
+		if self._purge_errors:
+			self._connection.execute("DELETE FROM lookups WHERE search_status = 'Ошибка'")
+		self._connection.commit()
+
+	def _get(self, identity_key: str) -> Optional[tuple[str, str]]:
+		row = self._connection.execute(
+			'SELECT inn, search_status FROM lookups WHERE identity_key = ? AND expires_at >= ?',
+			(identity_key, time.time())
+		).fetchone()
+		return tuple(row) if row else None
+
+	def _set(self, identity_key: str, inn: str, search_status: str, expires_at: float) -> None:
+		self._connection.execute(
+			'INSERT OR REPLACE INTO lookups (identity_key, inn, search_status, expires_at) VALUES (?, ?, ?, ?)',
+			(identity_key, inn, search_status, expires_at)
+		)
+		self._connection.commit()
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from logging import Logger
+
+from scraper.session import SessionManager
+from scraper.metrics import METRICS
+
+import ua_generator
+from aiohttp import ClientSession, ClientResponseError
+
+from bs4 import BeautifulSoup
+
+import asyncio
+import time
+from collections import deque
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+	from scraper.captcha_solver.model import CaptchaSolver
+
+
+NALOG_RU_BASE_URL = 'https://service.nalog.ru/'
+
+
+class CaptchaPool:
+	def __init__(self, session_manager: SessionManager, solver: CaptchaSolver, logger: Logger,
+	             pool_size: int = 2, token_ttl: float = 120.0, base_url: str = NALOG_RU_BASE_URL) -> None:
+		self._session_manager = session_manager
+		self._base_url = base_url
+		self._solver = solver
+		self._logger = logger
+
+		self._pool_size = pool_size
+		self._token_ttl = token_ttl
+
+		self._solved_captchas: deque[tuple[str, str, float]] = deque()
+		self._refill_event = asyncio.Event()
+		self._refill_task: asyncio.Task | None = None
+
+	async def __aenter__(self) -> 'CaptchaPool':
+		if self._pool_size > 0:
+			self._refill_task = asyncio.create_task(self._refill())
+		return self
+
+	async def __aexit__(self, *args, **kwargs) -> None:
+		if self._refill_task:
+			self._refill_task.cancel()
+			await asyncio.gather(self._refill_task, return_exceptions=True)
+		await asyncio.to_thread(self._solver.close)
+
+	async def get(self) -> tuple[str, str]:
+		self._refill_event.set()
+		while self._solved_captchas:
+			captcha_token, captcha, solved_time = self._solved_captchas.popleft()
+			if time.monotonic() - solved_time < self._token_ttl:
+				METRICS.inc('captcha_pool_total', result='hit')
+				return captcha_token, captcha
+
+		METRICS.inc('captcha_pool_total', result='miss')
+		captcha_token, captcha, _ = await self._solve_captcha()
+		return captcha_token, captcha
+
+	async def _refill(self) -> None:
+		while True:
+			await self._refill_event.wait()
+			self._refill_event.clear()
+
+			while self._solved_captchas and time.monotonic() - self._solved_captchas[0][2] >= self._token_ttl:
+				self._solved_captchas.popleft()
+
+			while len(self._solved_captchas) < self._pool_size:
+				try:
+					self._solved_captchas.append(await self._solve_captcha())
+				except Exception as e:
+					self._logger.error(f'Failed to pre-solve captcha: {type(e)} - {e}')
+					await asyncio.sleep(5)
+					break
+
+	async def _solve_captcha(self) -> tuple[str, str, float]:
+		ua = ua_generator.generate(device='desktop')
+		async with self._session_manager.acquire() as session:
+			captcha_token = await get_captcha_token(session=session, ua=ua, base_url=self._base_url)
+			captcha_img = await get_captcha_img(session=session, ua=ua, captcha_token=captcha_token,
+			                                    base_url=self._base_url)
+		with METRICS.time('stage_duration_seconds', provider='nalog.ru', stage='captcha_solve'):
+			captcha = await self._solver.solve_captcha_async(captcha_img=captcha_img)
+		return captcha_token, captcha, time.monotonic()
+
+
+async def get_captcha_token(session: ClientSession, ua, base_url: str = NALOG_RU_BASE_URL) -> str:
+	headers = {
+		'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+		'Accept-Language': 'ru,en;q=0.9,en-GB;q=0.8,en-US;q=0.7',
+		'Connection': 'keep-alive',
+		'DNT': '1',
+		'Referer': 'https://service.nalog.ru/inn.do',
+		'Sec-Fetch-Dest': 'iframe',
+		'Sec-Fetch-Mode': 'navigate',
+		'Sec-Fetch-Site': 'same-origin',
+		'Sec-Fetch-User': '?1',
+		'Upgrade-Insecure-Requests': '1',
+		'User-Agent': ua.text,
+		'sec-ch-ua': ua.ch.brands,
+		'sec-ch-ua-mobile': ua.ch.mobile,
+		'sec-ch-ua-platform': ua.ch.platform,
+	}
+	params = {
+		'aver': '3.48.6',
+		'sver': '4.40.31',
+		'pageStyle': 'GM2',
+	}
+	async with session.get(url=base_url + 'static/captcha-dialog.html', params=params,
+	                       headers=headers) as captcha_token_resp:
+		captcha_page = await captcha_token_resp.text()
+
+		captcha_page_soup = BeautifulSoup(captcha_page, features='html.parser')
+		captcha_token_el = captcha_page_soup.find(name='input', attrs={'type': 'hidden', 'name': 'captchaToken'})
+		if captcha_token_el is None or not captcha_token_el.get('value'):
+			raise ClientResponseError(
+				request_info=captcha_token_resp.request_info,
+				history=captcha_token_resp.history,
+				message='No captcha token was found'
+			)
+
+		return captcha_token_el.get('value')
+
+
+async def get_captcha_img(session: ClientSession, ua, captcha_token: str, base_url: str = NALOG_RU_BASE_URL) -> bytes:
+	headers = {
+		'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+		'Accept-Language': 'ru,en;q=0.9,en-GB;q=0.8,en-US;q=0.7',
+		'Cache-Control': 'max-age=0',
+		'Connection': 'keep-alive',
+		'DNT': '1',
+		'Sec-Fetch-Dest': 'document',
+		'Sec-Fetch-Mode': 'navigate',
+		'Sec-Fetch-Site': 'none',
+		'Sec-Fetch-User': '?1',
+		'Upgrade-Insecure-Requests': '1',
+		'User-Agent': ua.text,
+		'sec-ch-ua': ua.ch.brands,
+		'sec-ch-ua-mobile': ua.ch.mobile,
+		'sec-ch-ua-platform': ua.ch.platform,
+	}
+	params = {
+		'a': captcha_token,
+		'version': '2',
+	}
+	async with session.get(url=base_url + 'static/captcha.bin', params=params, headers=headers) as captcha_resp:
+		return await captcha_resp.read()
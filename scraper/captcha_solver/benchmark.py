@@ -0,0 +1,102 @@
+import numpy as np
+
+from argparse import ArgumentParser
+import glob
+import json
+import os
+import time
+
+from typing import Optional
+
+from scraper.captcha_solver.model import CaptchaSolver, MODEL_CFG_DIR, VARIANTS_DIR, DEFAULT_VARIANT
+from scraper.captcha_solver.variants import load_labeled_imgs, read_model_img
+from scraper.captcha_solver.dataset_store import CaptchaDatasetStore
+from scraper.metrics import quantile
+
+
+def get_variants() -> list[str]:
+	variant_files = sorted(glob.glob(os.path.join(VARIANTS_DIR, '*.onnx')))
+	return [DEFAULT_VARIANT] + [os.path.splitext(os.path.basename(variant_file))[0] for variant_file in variant_files]
+
+
+def benchmark_variant(variant: str, imgs: list[np.ndarray], labels: list[str], batch_size: int = 32,
+                      intra_op_threads: int = 0, warmup_num: int = 5) -> dict[str, float]:
+	solver = CaptchaSolver.load(variant=variant, intra_op_threads=intra_op_threads)
+
+	for img in imgs[:warmup_num]:
+		solver.predict(img=img)
+
+	latencies = []
+	solutions = []
+	for img in imgs:
+		start_time = time.perf_counter()
+		solutions.append(solver.predict(img=img))
+		latencies.append(time.perf_counter() - start_time)
+
+	start_time = time.perf_counter()
+	for batch_start in range(0, len(imgs), batch_size):
+		solver.predict_batch(imgs=imgs[batch_start:batch_start + batch_size])
+	batch_time = time.perf_counter() - start_time
+
+	latencies.sort()
+	return {
+		'accuracy': sum(solution == label for solution, label in zip(solutions, labels)) / len(labels),
+		'p50_ms': quantile(latencies, 0.5) * 1000,
+		'p99_ms': quantile(latencies, 0.99) * 1000,
+		'imgs_per_second': len(imgs) / sum(latencies),
+		'batched_imgs_per_second': len(imgs) / batch_time,
+		'model_size_mb': os.path.getsize(solver.model_path) / 1024 / 1024,
+	}
+
+
+def load_val_imgs(dataset_dir: str,
+                  labels_file: str = os.path.join(MODEL_CFG_DIR, 'val.csv')) -> tuple[list[np.ndarray], list[str]]:
+	labeled_imgs = [
+		(img_path, label) for img_path, label in load_labeled_imgs(labels_file=labels_file, dataset_dir=dataset_dir)
+		if os.path.exists(img_path)
+	]
+	if not labeled_imgs:
+		raise ValueError(f'No images from {labels_file} were found in {dataset_dir}')
+
+	return [read_model_img(img_path=img_path) for img_path, _ in labeled_imgs], [label for _, label in labeled_imgs]
+
+
+def load_store_imgs(store_dir: str) -> tuple[list[np.ndarray], list[str]]:
+	labeled_imgs = list(CaptchaDatasetStore(store_dir=store_dir).iter_labeled())
+	if not labeled_imgs:
+		raise ValueError(f'No labeled captchas in {store_dir}')
+
+	return [img for img, _ in labeled_imgs], [label for _, label in labeled_imgs]
+
+
+def benchmark_variants(imgs: list[np.ndarray], labels: list[str], variants: Optional[list[str]] = None,
+                       **kwargs) -> dict[str, dict[str, float]]:
+	return {
+		variant: benchmark_variant(variant=variant, imgs=imgs, labels=labels, **kwargs)
+		for variant in variants or get_variants()
+	}
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='Measure accuracy and CPU latency of the captcha model variants on val.csv')
+	imgs_source = parser.add_mutually_exclusive_group(required=True)
+	imgs_source.add_argument('--dataset-dir', help='directory the image paths in val.csv are relative to')
+	imgs_source.add_argument('--store', help='packed captcha dataset store with labeled captchas')
+	parser.add_argument('--variants', nargs='+', help='variants to benchmark (all built variants by default)')
+	parser.add_argument('--batch-size', type=int, default=32, help='batch size for the batched throughput run')
+	parser.add_argument('--threads', type=int, default=0, help='intra-op threads (0 - onnxruntime default)')
+	parser.add_argument('--report', metavar='FILE', help='JSON file to write the results to')
+	args = parser.parse_args()
+
+	val_imgs, val_labels = load_store_imgs(store_dir=args.store) if args.store else load_val_imgs(dataset_dir=args.dataset_dir)
+	results = benchmark_variants(imgs=val_imgs, labels=val_labels, variants=args.variants, batch_size=args.batch_size,
+	                             intra_op_threads=args.threads)
+
+	print(f'{"variant":<16}{"accuracy":>10}{"p50, ms":>10}{"p99, ms":>10}{"img/s":>10}{"batch img/s":>14}{"MB":>8}')
+	for variant, result in results.items():
+		print(f'{variant:<16}{result["accuracy"]:>10.3f}{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}'
+		      f'{result["imgs_per_second"]:>10.1f}{result["batched_imgs_per_second"]:>14.1f}{result["model_size_mb"]:>8.2f}')
+
+	if args.report:
+		with open(args.report, 'w', encoding='utf-8') as report_file_obj:
+			json.dump(results, report_file_obj, indent=2)
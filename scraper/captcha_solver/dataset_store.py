@@ -0,0 +1,159 @@
+import cv2
+import numpy as np
+
+from argparse import ArgumentParser
+import csv
+import glob
+import os
+import threading
+from hashlib import sha256
+
+from typing import Iterable, Iterator
+
+
+_INDEX_COLUMNS = ('sha256', 'label', 'shard', 'position')
+
+
+class CaptchaDatasetStore:
+	def __init__(self, store_dir: str, shard_size: int = 10000, img_shape: tuple[int, int, int] = (100, 200, 3)) -> None:
+		self._store_dir = store_dir
+		self._shard_size = shard_size
+		self._img_shape = img_shape
+		self._img_size = int(np.prod(img_shape))
+
+		self._index_file = os.path.join(store_dir, 'index.csv')
+		self._hashes: set[str] = set()
+		self._labels: list[str] = []
+		self._shard_lens: list[int] = []
+		self._lock = threading.Lock()
+
+		os.makedirs(store_dir, exist_ok=True)
+		self._load_index()
+
+	def __len__(self) -> int:
+		return len(self._labels)
+
+	@property
+	def labels(self) -> list[str]:
+		return list(self._labels)
+
+	@property
+	def shards_num(self) -> int:
+		return len(self._shard_lens)
+
+	def add(self, img_bytes: bytes, label: str = '') -> bool:
+		img = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+		if img is None:
+			raise ValueError('Failed to decode captcha image')
+
+		return self.add_array(img=img, label=label)
+
+	def add_array(self, img: np.ndarray, label: str = '') -> bool:
+		if img.shape != self._img_shape:
+			img = cv2.resize(img, self._img_shape[1::-1])
+		img = np.ascontiguousarray(img, dtype=np.uint8)
+		img_hash = sha256(img.tobytes()).hexdigest()
+
+		with self._lock:
+			if img_hash in self._hashes:
+				return False
+
+			if not self._shard_lens or self._shard_lens[-1] >= self._shard_size:
+				self._shard_lens.append(0)
+			shard_idx = len(self._shard_lens) - 1
+
+			with open(self._get_shard_file(shard_idx), 'ab') as shard_file_obj:
+				shard_file_obj.write(img.tobytes())
+
+			is_new_index = not os.path.exists(self._index_file) or not os.path.getsize(self._index_file)
+			with open(self._index_file, 'a', newline='', encoding='utf-8') as index_file_obj:
+				index_writer = csv.writer(index_file_obj)
+				if is_new_index:
+					index_writer.writerow(_INDEX_COLUMNS)
+				index_writer.writerow((img_hash, label, shard_idx, self._shard_lens[shard_idx]))
+
+			self._hashes.add(img_hash)
+			self._labels.append(label)
+			self._shard_lens[shard_idx] += 1
+
+		return True
+
+	def get_shard(self, shard_idx: int) -> np.memmap:
+		return np.memmap(self._get_shard_file(shard_idx), dtype=np.uint8, mode='r',
+		                 shape=(self._shard_lens[shard_idx], *self._img_shape))
+
+	def iter_labeled(self, labeled_only: bool = True) -> Iterator[tuple[np.ndarray, str]]:
+		img_idx = 0
+		for shard_idx, shard_len in enumerate(self._shard_lens):
+			shard = self.get_shard(shard_idx)
+			for position in range(shard_len):
+				label = self._labels[img_idx]
+				img_idx += 1
+				if label or not labeled_only:
+					yield shard[position], label
+
+	def import_imgs(self, labeled_imgs: Iterable[tuple[str, str]]) -> tuple[int, int]:
+		added_num, skipped_num = 0, 0
+		for img_path, label in labeled_imgs:
+			with open(img_path, 'rb') as img_file_obj:
+				is_added = self.add(img_bytes=img_file_obj.read(), label=label)
+			added_num += is_added
+			skipped_num += not is_added
+
+		return added_num, skipped_num
+
+	def _get_shard_file(self, shard_idx: int) -> str:
+		return os.path.join(self._store_dir, f'images-{shard_idx:05}.u8')
+
+	def _load_index(self) -> None:
+		if not os.path.exists(self._index_file):
+			return
+
+		with open(self._index_file, 'r+b') as index_file_obj:
+			index_data = index_file_obj.read()
+			if not index_data.endswith(b'\n'):
+				index_file_obj.truncate(index_data.rfind(b'\n') + 1)
+
+		with open(self._index_file, newline='', encoding='utf-8') as index_file_obj:
+			rows = csv.reader(index_file_obj)
+			next(rows, None)
+			for img_hash, label, shard_idx, position in rows:
+				shard_idx, position = int(shard_idx), int(position)
+				while len(self._shard_lens) <= shard_idx:
+					self._shard_lens.append(0)
+
+				self._hashes.add(img_hash)
+				self._labels.append(label)
+				self._shard_lens[shard_idx] = position + 1
+
+		for shard_idx, shard_len in enumerate(self._shard_lens):
+			shard_file = self._get_shard_file(shard_idx)
+			stored_size = os.path.getsize(shard_file) if os.path.exists(shard_file) else 0
+			if stored_size < shard_len * self._img_size:
+				raise ValueError(f'Captcha dataset shard is shorter than its index: {shard_file}')
+			if stored_size > shard_len * self._img_size:
+				with open(shard_file, 'r+b') as shard_file_obj:
+					shard_file_obj.truncate(shard_len * self._img_size)
+
+
+if __name__ == '__main__':
+	from scraper.captcha_solver.variants import load_labeled_imgs
+
+	parser = ArgumentParser(description='Pack captcha images into a memory-mappable dataset store')
+	parser.add_argument('--store', required=True, help='dataset store directory')
+	parser.add_argument('--labels', help='CSV with image paths and labels (e.g. model_cfg/train.csv)')
+	parser.add_argument('--dataset-dir', default='.', help='directory the image paths in --labels are relative to')
+	parser.add_argument('--imgs', help='glob of unlabeled images to add (e.g. "captcha_imgs/*.png")')
+	args = parser.parse_args()
+
+	dataset_store = CaptchaDatasetStore(store_dir=args.store)
+	imgs_to_import = []
+	if args.labels:
+		imgs_to_import += load_labeled_imgs(labels_file=args.labels, dataset_dir=args.dataset_dir)
+	if args.imgs:
+		imgs_to_import += [(img_path, '') for img_path in sorted(glob.glob(args.imgs))]
+
+	existing_imgs = [(img_path, label) for img_path, label in imgs_to_import if os.path.exists(img_path)]
+	added, skipped = dataset_store.import_imgs(labeled_imgs=existing_imgs)
+	print(f'Added: {added}, duplicates: {skipped}, missing: {len(imgs_to_import) - len(existing_imgs)}, '
+	      f'total: {len(dataset_store)} in {dataset_store.shards_num} shards')
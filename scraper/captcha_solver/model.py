@@ -3,51 +3,162 @@ from mltu.utils.text_utils import ctc_decoder
 
 from mltu.configs import BaseModelConfigs
 
+import onnxruntime as ort
+
 import cv2
 import numpy as np
 
 import os
 from pathlib import Path
 
+import asyncio
+import queue
 import threading
+import time
+from concurrent.futures import Future
 
 from typing import Union, Optional
 
 
 current_file = __file__
 
+MODEL_CFG_DIR = os.path.join(Path(current_file).parent, 'model_cfg')
+VARIANTS_DIR = os.path.join(MODEL_CFG_DIR, 'variants')
+DEFAULT_VARIANT = 'model'
+
+
+def get_variant_path(variant: str = DEFAULT_VARIANT) -> str:
+	if variant == DEFAULT_VARIANT:
+		return os.path.join(MODEL_CFG_DIR, 'model.onnx')
+	return os.path.join(VARIANTS_DIR, f'{variant}.onnx')
+
 
 class CaptchaSolver(OnnxInferenceModel):
-	def __init__(self, model_path: str, char_list: Union[str, list], *args, **kwargs):
+	def __init__(self, model_path: str, char_list: Union[str, list], intra_op_threads: int = 0,
+	             inter_op_threads: int = 0, max_batch_size: int = 32, max_batch_wait: float = 0.005,
+	             *args, **kwargs):
 		super().__init__(model_path=model_path, *args, **kwargs)
+		if intra_op_threads or inter_op_threads:
+			sess_options = ort.SessionOptions()
+			sess_options.intra_op_num_threads = intra_op_threads
+			sess_options.inter_op_num_threads = inter_op_threads
+			self.model = ort.InferenceSession(self.model_path, sess_options=sess_options, providers=self.model.get_providers())
+
+		model_input = self.model.get_inputs()[0]
+		self._input_name = model_input.name
+		self._input_size = tuple(model_input.shape[1:3][::-1])
+		self._fixed_batch_size = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
 		self._char_list = char_list
+
+		self._max_batch_size = self._fixed_batch_size or max_batch_size
+		self._max_batch_wait = max_batch_wait
+		self._pending_imgs: queue.Queue[Optional[tuple[np.ndarray, Future]]] = queue.Queue()
+		self._batch_thread: Optional[threading.Thread] = None
 		self._thread_lock = threading.Lock()
 
 	@classmethod
-	def load(cls) -> 'CaptchaSolver':
-		model_path = os.path.join(Path(current_file).parent, 'model_cfg')
-		model_configs = BaseModelConfigs.load(os.path.join(model_path, 'configs.yaml'))
-		return cls(model_path=model_path, char_list=model_configs.vocab)
+	def load(cls, variant: Optional[str] = None, **kwargs) -> 'CaptchaSolver':
+		model_configs = BaseModelConfigs.load(os.path.join(MODEL_CFG_DIR, 'configs.yaml'))
+		variant = variant or getattr(model_configs, 'model_variant', None) or DEFAULT_VARIANT
+		return cls(model_path=get_variant_path(variant=variant), char_list=model_configs.vocab, **kwargs)
 
 	def predict(self, img: np.ndarray) -> str:
-		img = cv2.resize(img, self.input_shape[:2][::-1])
-		img_pred = np.expand_dims(img, axis=0).astype(np.float32)
-		preds = self.model.run(None, {self.input_name: img_pred})[0]
+		return self.predict_batch(imgs=[img])[0]
 
-		text = ctc_decoder(preds, self._char_list)[0]
-		return text
+	def predict_batch(self, imgs: list[np.ndarray]) -> list[str]:
+		imgs_pred = np.stack([self._resize(img=img) for img in imgs]).astype(np.float32)
+		if not self._fixed_batch_size:
+			return ctc_decoder(self.model.run(None, {self._input_name: imgs_pred})[0], self._char_list)
+
+		solutions = []
+		for batch_start in range(0, len(imgs_pred), self._fixed_batch_size):
+			batch = imgs_pred[batch_start:batch_start + self._fixed_batch_size]
+			padding = self._fixed_batch_size - len(batch)
+			if padding:
+				batch = np.concatenate([batch, np.zeros((padding, *batch.shape[1:]), dtype=batch.dtype)])
+			solutions += ctc_decoder(self.model.run(None, {self._input_name: batch})[0], self._char_list)[:len(batch) - padding]
+
+		return solutions
+
+	def submit(self, captcha_img: Optional[bytes] = None, captcha_img_path: Optional[str] = None) -> Future:
+		captcha_img_ndarray = self._resize(img=self._read_img(captcha_img=captcha_img, captcha_img_path=captcha_img_path))
+
+		self._start_batch_thread()
+		solution_future = Future()
+		self._pending_imgs.put((captcha_img_ndarray, solution_future))
+		return solution_future
 
 	def solve_captcha(self, captcha_img: Optional[bytes] = None, captcha_img_path: Optional[str] = None) -> str:
+		return self.submit(captcha_img=captcha_img, captcha_img_path=captcha_img_path).result()
+
+	async def solve_captcha_async(self, captcha_img: Optional[bytes] = None, captcha_img_path: Optional[str] = None) -> str:
+		solution_future = await asyncio.to_thread(self.submit, captcha_img=captcha_img, captcha_img_path=captcha_img_path)
+		return await asyncio.wrap_future(solution_future)
+
+	def close(self) -> None:
 		with self._thread_lock:
-			if captcha_img and captcha_img_path:
-				raise ValueError('Got both image and image path')
-			elif not captcha_img and not captcha_img_path:
-				raise ValueError('Expecting image or image path, got neither')
-
-			if captcha_img:
-				nparr = np.frombuffer(captcha_img, np.uint8)
-				captcha_img_ndarray = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-			elif captcha_img_path:
-				captcha_img_ndarray = cv2.imread(captcha_img_path)
-
-			return self.predict(img=captcha_img_ndarray)
+			if self._batch_thread:
+				self._pending_imgs.put(None)
+				self._batch_thread.join()
+				self._batch_thread = None
+
+	def _resize(self, img: np.ndarray) -> np.ndarray:
+		if img.shape[1::-1] == self._input_size:
+			return img
+		return cv2.resize(img, self._input_size)
+
+	@staticmethod
+	def _read_img(captcha_img: Optional[bytes] = None, captcha_img_path: Optional[str] = None) -> np.ndarray:
+		if captcha_img and captcha_img_path:
+			raise ValueError('Got both image and image path')
+		elif not captcha_img and not captcha_img_path:
+			raise ValueError('Expecting image or image path, got neither')
+
+		if captcha_img:
+			nparr = np.frombuffer(captcha_img, np.uint8)
+			captcha_img_ndarray = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+		else:
+			captcha_img_ndarray = cv2.imread(captcha_img_path)
+
+		if captcha_img_ndarray is None:
+			raise ValueError('Failed to decode captcha image')
+
+		return captcha_img_ndarray
+
+	def _start_batch_thread(self) -> None:
+		with self._thread_lock:
+			if not self._batch_thread:
+				self._batch_thread = threading.Thread(target=self._solve_batches, name='captcha-solver', daemon=True)
+				self._batch_thread.start()
+
+	def _solve_batches(self) -> None:
+		while True:
+			pending_img = self._pending_imgs.get()
+			if pending_img is None:
+				return
+
+			batch = [pending_img]
+			batch_deadline = time.monotonic() + self._max_batch_wait
+			while len(batch) < self._max_batch_size:
+				try:
+					pending_img = self._pending_imgs.get(timeout=max(batch_deadline - time.monotonic(), 0))
+				except queue.Empty:
+					break
+
+				if pending_img is None:
+					self._pending_imgs.put(None)
+					break
+				batch.append(pending_img)
+
+			batch = [(img, future) for img, future in batch if future.set_running_or_notify_cancel()]
+			if not batch:
+				continue
+
+			try:
+				solutions = self.predict_batch(imgs=[img for img, _ in batch])
+			except Exception as e:
+				for _, future in batch:
+					future.set_exception(e)
+			else:
+				for (_, future), solution in zip(batch, solutions):
+					future.set_result(solution)
@@ -0,0 +1,125 @@
+import onnx
+import onnxruntime as ort
+from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic,
+                                      quantize_static)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+import cv2
+import numpy as np
+
+from argparse import ArgumentParser
+import csv
+import os
+import tempfile
+
+from typing import Iterator, Optional
+
+from scraper.captcha_solver.model import MODEL_CFG_DIR, VARIANTS_DIR, get_variant_path
+
+
+def load_labeled_imgs(labels_file: str, dataset_dir: str) -> list[tuple[str, str]]:
+	labeled_imgs = []
+	with open(labels_file, newline='', encoding='utf-8') as labels_file_obj:
+		rows = csv.reader(labels_file_obj)
+		next(rows, None)
+		for img_path, label in rows:
+			labeled_imgs.append((os.path.join(dataset_dir, *img_path.replace('\\', '/').split('/')), label))
+
+	return labeled_imgs
+
+
+def read_model_img(img_path: str, input_size: tuple[int, int] = (200, 100)) -> np.ndarray:
+	img = cv2.imread(img_path)
+	if img is None:
+		raise ValueError(f'Failed to read captcha image: {img_path}')
+	if img.shape[1::-1] != input_size:
+		img = cv2.resize(img, input_size)
+	return img.astype(np.float32)
+
+
+class _CaptchaCalibrationReader(CalibrationDataReader):
+	def __init__(self, input_name: str, img_paths: list[str]) -> None:
+		self._input_name = input_name
+		self._img_paths = iter(img_paths)
+
+	def get_next(self) -> Optional[dict[str, np.ndarray]]:
+		img_path = next(self._img_paths, None)
+		if img_path is None:
+			return None
+		return {self._input_name: read_model_img(img_path=img_path)[np.newaxis]}
+
+
+def optimize_graph(model_file: str, output_file: str) -> None:
+	sess_options = ort.SessionOptions()
+	sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+	sess_options.optimized_model_filepath = output_file
+	ort.InferenceSession(model_file, sess_options=sess_options, providers=['CPUExecutionProvider'])
+
+
+def quantize_int8_dynamic(model_file: str, output_file: str) -> None:
+	quantize_dynamic(model_input=model_file, model_output=output_file, weight_type=QuantType.QInt8)
+
+
+def quantize_int8_static(model_file: str, output_file: str, calibration_img_paths: list[str]) -> None:
+	model_input_name = onnx.load(model_file).graph.input[0].name
+	with tempfile.TemporaryDirectory(prefix='captcha_quant_') as tmp_dir:
+		preprocessed_model_file = os.path.join(tmp_dir, 'model.onnx')
+		quant_pre_process(input_model_path=model_file, output_model_path=preprocessed_model_file,
+		                  skip_symbolic_shape=True)
+		quantize_static(
+			model_input=preprocessed_model_file,
+			model_output=output_file,
+			calibration_data_reader=_CaptchaCalibrationReader(input_name=model_input_name,
+			                                                  img_paths=calibration_img_paths),
+			quant_format=QuantFormat.QDQ,
+			per_channel=True,
+			weight_type=QuantType.QInt8,
+			activation_type=QuantType.QUInt8
+		)
+
+
+def fix_batch_size(model_file: str, output_file: str, batch_size: int) -> None:
+	model = onnx.load(model_file)
+	for graph_io in (*model.graph.input, *model.graph.output):
+		batch_dim = graph_io.type.tensor_type.shape.dim[0]
+		batch_dim.Clear()
+		batch_dim.dim_value = batch_size
+
+	del model.graph.value_info[:]
+	onnx.save(onnx.shape_inference.infer_shapes(model), output_file)
+
+
+def build_variants(dataset_dir: Optional[str] = None, batch_sizes: tuple[int, ...] = (1, 8),
+                   calibration_imgs_num: int = 200) -> Iterator[str]:
+	os.makedirs(VARIANTS_DIR, exist_ok=True)
+	model_file = get_variant_path()
+
+	optimize_graph(model_file=model_file, output_file=get_variant_path('optimized'))
+	yield 'optimized'
+
+	quantize_int8_dynamic(model_file=model_file, output_file=get_variant_path('int8_dynamic'))
+	yield 'int8_dynamic'
+
+	if dataset_dir:
+		labeled_imgs = load_labeled_imgs(labels_file=os.path.join(MODEL_CFG_DIR, 'train.csv'), dataset_dir=dataset_dir)
+		calibration_img_paths = [img_path for img_path, _ in labeled_imgs if os.path.exists(img_path)]
+		if calibration_img_paths:
+			quantize_int8_static(model_file=model_file, output_file=get_variant_path('int8_static'),
+			                     calibration_img_paths=calibration_img_paths[:calibration_imgs_num])
+			yield 'int8_static'
+
+	for batch_size in batch_sizes:
+		fix_batch_size(model_file=model_file, output_file=get_variant_path(f'batch_{batch_size}'),
+		               batch_size=batch_size)
+		yield f'batch_{batch_size}'
+
+
+if __name__ == '__main__':
+	parser = ArgumentParser(description='Build optimized and quantized variants of the captcha model')
+	parser.add_argument('--dataset-dir', help='directory the image paths in train.csv/val.csv are relative to '
+	                                          '(needed for static INT8 calibration)')
+	parser.add_argument('--batch-sizes', type=int, nargs='*', default=[1, 8], help='fixed batch sizes to export')
+	args = parser.parse_args()
+
+	for built_variant in build_variants(dataset_dir=args.dataset_dir, batch_sizes=tuple(args.batch_sizes)):
+		print(f'{built_variant}: {get_variant_path(built_variant)}')
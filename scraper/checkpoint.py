@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from excel.xlsx_io import Person
+from excel.results_writer import ResultsWriter
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+
+from typing import AsyncIterable, AsyncIterator, Optional
+
+
+_COMPLETED_STATUSES = {'Успешно', 'ИНН не найден'}
+
+
+class CheckpointJournal:
+	def __init__(self, journal_file: str, resume: bool = False) -> None:
+		self._journal_file = journal_file
+		self._resume = resume
+
+		self._completed: dict[str, tuple[str, str]] = {}
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint-journal')
+		self._journal_file_obj = None
+
+	@property
+	def journal_file(self) -> str:
+		return self._journal_file
+
+	@property
+	def completed_num(self) -> int:
+		return len(self._completed)
+
+	async def __aenter__(self) -> 'CheckpointJournal':
+		await self._run(self._open)
+		return self
+
+	async def __aexit__(self, *args, **kwargs) -> None:
+		await self._run(self._journal_file_obj.close)
+		self._executor.shutdown(wait=True)
+
+	def get_result(self, person: Person) -> Optional[tuple[str, str]]:
+		return self._completed.get(person.identity_key)
+
+	async def record(self, person: Person) -> None:
+		if person.inn_search_status in _COMPLETED_STATUSES:
+			self._completed[person.identity_key] = (person.inn, person.inn_search_status)
+
+		record = {
+			'identity_key': person.identity_key,
+			'person_id': person.person_id,
+			'inn': person.inn,
+			'inn_search_status': person.inn_search_status,
+		}
+		await self._run(self._write, json.dumps(record, ensure_ascii=False))
+
+	async def skip_completed(self, persons: AsyncIterable[Person],
+	                         results_writer: ResultsWriter) -> AsyncIterator[Person]:
+		async for person in persons:
+			completed_result = self.get_result(person=person)
+			if completed_result:
+				person.inn, person.inn_search_status = completed_result
+				await results_writer.put(checked_person=person)
+			else:
+				yield person
+
+	async def _run(self, func, *args):
+		return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+	def _open(self) -> None:
+		journal_dir = os.path.dirname(self._journal_file)
+		if journal_dir:
+			os.makedirs(journal_dir, exist_ok=True)
+
+		if self._resume:
+			self._load()
+		elif os.path.exists(self._journal_file):
+			raise FileExistsError(f'Checkpoint journal already exists, use resume mode: {self._journal_file}')
+
+		self._journal_file_obj = open(self._journal_file, 'a', encoding='utf-8')
+
+	def _load(self) -> None:
+		if not os.path.exists(self._journal_file):
+			raise FileNotFoundError(f'No checkpoint journal to resume from: {self._journal_file}')
+
+		line = ''
+		with open(self._journal_file, encoding='utf-8') as journal_file_obj:
+			for line in journal_file_obj:
+				try:
+					record = json.loads(line)
+				except json.JSONDecodeError:
+					continue
+
+				if record['inn_search_status'] in _COMPLETED_STATUSES:
+					self._completed[record['identity_key']] = (record['inn'], record['inn_search_status'])
+
+		if line and not line.endswith('\n'):
+			with open(self._journal_file, 'a', encoding='utf-8') as journal_file_obj:
+				journal_file_obj.write('\n')
+
+	def _write(self, line: str) -> None:
+		self._journal_file_obj.write(line + '\n')
+		self._journal_file_obj.flush()
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+from scraper.metrics import METRICS
+
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+
+from typing import AsyncIterator, Callable
+
+
+class CircuitState(str, Enum):
+	CLOSED = 'closed'
+	OPEN = 'open'
+	HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+	pass
+
+
+class CircuitBreaker:
+	def __init__(self, name: str, is_failure: Callable[[BaseException], bool],
+	             window_size: int = 50, min_requests: int = 20, failure_threshold: float = 0.5,
+	             open_timeout: float = 30.0, max_open_timeout: float = 300.0, half_open_probes: int = 3) -> None:
+		self.name = name
+		self._is_failure = is_failure
+
+		self._outcomes: deque[bool] = deque(maxlen=window_size)
+		self._min_requests = min_requests
+		self._failure_threshold = failure_threshold
+
+		self._base_open_timeout = open_timeout
+		self._max_open_timeout = max_open_timeout
+		self._open_timeout = open_timeout
+		self._opened_until = 0.0
+
+		self._half_open_probes = half_open_probes
+		self._probes_in_flight = 0
+		self._probes_succeeded = 0
+
+		self._state = CircuitState.CLOSED
+
+	@property
+	def state(self) -> CircuitState:
+		if self._state == CircuitState.OPEN and time.monotonic() >= self._opened_until:
+			self._set_state(CircuitState.HALF_OPEN)
+			self._probes_in_flight = 0
+			self._probes_succeeded = 0
+		return self._state
+
+	@property
+	def retry_after(self) -> float:
+		return max(self._opened_until - time.monotonic(), 0.0) if self.state == CircuitState.OPEN else 0.0
+
+	@property
+	def failure_rate(self) -> float:
+		return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+	@asynccontextmanager
+	async def guard(self) -> AsyncIterator[None]:
+		state = self.state
+		if state == CircuitState.OPEN or (state == CircuitState.HALF_OPEN and self._probes_in_flight >= self._half_open_probes):
+			METRICS.inc('circuit_rejections_total', provider=self.name)
+			raise CircuitOpenError(f'Circuit is {state.value} ({self.name}), retry after {self.retry_after:.1f} s')
+
+		is_probe = state == CircuitState.HALF_OPEN
+		if is_probe:
+			self._probes_in_flight += 1
+		try:
+			yield
+		except Exception as e:
+			self._record(is_success=not self._is_failure(e), is_probe=is_probe)
+			raise
+		else:
+			self._record(is_success=True, is_probe=is_probe)
+		finally:
+			if is_probe:
+				self._probes_in_flight -= 1
+
+	def _record(self, is_success: bool, is_probe: bool) -> None:
+		if self._state == CircuitState.HALF_OPEN:
+			if not is_success:
+				self._open(open_timeout=min(self._open_timeout * 2, self._max_open_timeout))
+			elif is_probe:
+				self._probes_succeeded += 1
+				if self._probes_succeeded >= self._half_open_probes:
+					self._close()
+			return
+
+		if self._state == CircuitState.OPEN:
+			return
+
+		self._outcomes.append(is_success)
+		if len(self._outcomes) >= self._min_requests and self.failure_rate >= self._failure_threshold:
+			self._open(open_timeout=self._base_open_timeout)
+
+	def _open(self, open_timeout: float) -> None:
+		self._open_timeout = open_timeout
+		self._opened_until = time.monotonic() + open_timeout
+		self._outcomes.clear()
+		self._set_state(CircuitState.OPEN)
+
+	def _close(self) -> None:
+		self._open_timeout = self._base_open_timeout
+		self._outcomes.clear()
+		self._set_state(CircuitState.CLOSED)
+
+	def _set_state(self, state: CircuitState) -> None:
+		if state != self._state:
+			self._state = state
+			METRICS.inc('circuit_transitions_total', provider=self.name, state=state.value)
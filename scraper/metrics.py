@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+from aiohttp import web
+
+import bisect
+import json
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from typing import Callable, Iterator, Sequence
+
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_LabelsKey = tuple[tuple[str, str], ...]
+
+
+def quantile(sorted_values: Sequence[float], q: float) -> float:
+	return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)] if sorted_values else 0.0
+
+
+def _get_labels_key(labels: dict[str, object]) -> _LabelsKey:
+	return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels_key: _LabelsKey, **extra_labels: str) -> str:
+	labels = labels_key + tuple(extra_labels.items())
+	if not labels:
+		return ''
+
+	escaped_labels = (
+		(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in labels
+	)
+	return '{' + ','.join(f'{name}="{value}"' for name, value in escaped_labels) + '}'
+
+
+class Histogram:
+	def __init__(self, buckets: Sequence[float] = _DEFAULT_BUCKETS, max_samples: int = 10000) -> None:
+		self.buckets = tuple(buckets)
+		self.bucket_counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self._samples: deque[float] = deque(maxlen=max_samples)
+
+	def observe(self, value: float) -> None:
+		self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+		self._samples.append(value)
+
+	def summary(self) -> dict[str, float]:
+		samples = sorted(self._samples)
+		if not samples:
+			return {'count': 0, 'sum': 0.0}
+
+		return {
+			'count': self.count,
+			'sum': self.sum,
+			'mean': self.sum / self.count,
+			'p50': quantile(samples, 0.5),
+			'p95': quantile(samples, 0.95),
+			'p99': quantile(samples, 0.99),
+			'max': samples[-1],
+		}
+
+
+class MetricsRegistry:
+	def __init__(self, prefix: str = 'inn_searcher') -> None:
+		self._prefix = prefix
+		self._counters: defaultdict[str, defaultdict[_LabelsKey, float]] = defaultdict(lambda: defaultdict(float))
+		self._histograms: defaultdict[str, dict[_LabelsKey, Histogram]] = defaultdict(dict)
+		self._gauges: defaultdict[str, dict[_LabelsKey, Callable[[], float]]] = defaultdict(dict)
+		self._start_time = time.monotonic()
+
+	def inc(self, name: str, value: float = 1.0, **labels) -> None:
+		self._counters[name][_get_labels_key(labels)] += value
+
+	def observe(self, name: str, value: float, **labels) -> None:
+		labels_key = _get_labels_key(labels)
+		histogram = self._histograms[name].get(labels_key)
+		if histogram is None:
+			histogram = self._histograms[name][labels_key] = Histogram()
+		histogram.observe(value)
+
+	def set_gauge(self, name: str, func: Callable[[], float], **labels) -> None:
+		self._gauges[name][_get_labels_key(labels)] = func
+
+	@contextmanager
+	def time(self, name: str, **labels) -> Iterator[None]:
+		start_time = time.monotonic()
+		try:
+			yield
+		finally:
+			self.observe(name, time.monotonic() - start_time, **labels)
+
+	def render_prometheus(self) -> str:
+		lines = []
+		for name, counters in self._counters.items():
+			lines.append(f'# TYPE {self._prefix}_{name} counter')
+			lines += [f'{self._prefix}_{name}{_format_labels(key)} {value}' for key, value in counters.items()]
+
+		for name, gauges in self._gauges.items():
+			lines.append(f'# TYPE {self._prefix}_{name} gauge')
+			lines += [f'{self._prefix}_{name}{_format_labels(key)} {func()}' for key, func in gauges.items()]
+
+		for name, histograms in self._histograms.items():
+			lines.append(f'# TYPE {self._prefix}_{name} histogram')
+			for key, histogram in histograms.items():
+				cumulative_count = 0
+				for bucket, bucket_count in zip(histogram.buckets + (float('inf'),), histogram.bucket_counts):
+					cumulative_count += bucket_count
+					le = '+Inf' if bucket == float('inf') else str(bucket)
+					lines.append(f'{self._prefix}_{name}_bucket{_format_labels(key, le=le)} {cumulative_count}')
+				lines.append(f'{self._prefix}_{name}_sum{_format_labels(key)} {histogram.sum}')
+				lines.append(f'{self._prefix}_{name}_count{_format_labels(key)} {histogram.count}')
+
+		return '\n'.join(lines) + '\n'
+
+	def summary(self) -> dict:
+		def labels_str(key: _LabelsKey) -> str:
+			return ','.join(f'{name}={value}' for name, value in key)
+
+		return {
+			'uptime_seconds': time.monotonic() - self._start_time,
+			'counters': {
+				name: {labels_str(key): value for key, value in counters.items()}
+				for name, counters in self._counters.items()
+			},
+			'gauges': {
+				name: {labels_str(key): func() for key, func in gauges.items()}
+				for name, gauges in self._gauges.items()
+			},
+			'histograms': {
+				name: {labels_str(key): histogram.summary() for key, histogram in histograms.items()}
+				for name, histograms in self._histograms.items()
+			},
+		}
+
+	def write_summary(self, summary_file: str) -> None:
+		with open(summary_file, 'w', encoding='utf-8') as summary_file_obj:
+			json.dump(self.summary(), summary_file_obj, ensure_ascii=False, indent=2)
+
+
+METRICS = MetricsRegistry()
+
+
+class MetricsServer:
+	def __init__(self, registry: MetricsRegistry = METRICS, host: str = '127.0.0.1', port: int = 9108) -> None:
+		self._registry = registry
+		self._host = host
+		self._port = port
+		self._runner: web.AppRunner | None = None
+
+	async def __aenter__(self) -> 'MetricsServer':
+		app = web.Application()
+		app.router.add_get('/metrics', self._get_metrics)
+		app.router.add_get('/metrics.json', self._get_metrics_summary)
+
+		self._runner = web.AppRunner(app, access_log=None)
+		await self._runner.setup()
+		await web.TCPSite(self._runner, host=self._host, port=self._port).start()
+		return self
+
+	async def __aexit__(self, *args, **kwargs) -> None:
+		await self._runner.cleanup()
+
+	async def _get_metrics(self, request: web.Request) -> web.Response:
+		return web.Response(text=self._registry.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+	async def _get_metrics_summary(self, request: web.Request) -> web.Response:
+		return web.json_response(self._registry.summary(), dumps=lambda obj: json.dumps(obj, ensure_ascii=False))
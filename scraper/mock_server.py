@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from aiohttp import web
+
+import cv2
+import numpy as np
+
+import asyncio
+import math
+import random
+import secrets
+from dataclasses import dataclass, field
+from hashlib import sha256
+
+
+@dataclass
+class LatencyModel:
+	median: float = 0.2
+	sigma: float = 0.5
+	max_latency: float = 30.0
+
+	def sample(self) -> float:
+		if self.median <= 0:
+			return 0.0
+		return min(self.median * math.exp(random.gauss(0, self.sigma)), self.max_latency)
+
+
+@dataclass
+class MockProviderConfig:
+	nalog_ru_latency: LatencyModel = field(default_factory=LatencyModel)
+	ogu_latency: LatencyModel = field(default_factory=LatencyModel)
+	error_rate: float = 0.0
+	throttling_rate: float = 0.0
+	unavailable_rate: float = 0.0
+	captcha_rate: float = 0.0
+	not_found_rate: float = 0.1
+	stoken_page_size: int = 64 * 1024
+
+
+def _get_inn(person_key: str) -> str:
+	return str(int(sha256(person_key.encode('utf-8')).hexdigest(), 16))[:12]
+
+
+def _get_captcha_img() -> bytes:
+	captcha_img = np.full((100, 200, 3), 255, dtype=np.uint8)
+	cv2.putText(captcha_img, str(random.randint(100000, 999999)), (15, 65), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 3)
+	return cv2.imencode('.png', captcha_img)[1].tobytes()
+
+
+class MockProviderServer:
+	def __init__(self, config: MockProviderConfig | None = None, host: str = '127.0.0.1', port: int = 0) -> None:
+		self.config = config or MockProviderConfig()
+		self._host = host
+		self._port = port
+		self._runner: web.AppRunner | None = None
+
+		self._requests: dict[str, str] = {}
+		self._stokens: set[str] = set()
+		self._captcha_img = _get_captcha_img()
+		self.requests_num: dict[str, int] = {}
+
+	@property
+	def nalog_ru_base_url(self) -> str:
+		return f'http://{self._host}:{self._port}/nalog/'
+
+	@property
+	def ogu_base_url(self) -> str:
+		return f'http://{self._host}:{self._port}/ogu/'
+
+	async def __aenter__(self) -> 'MockProviderServer':
+		app = web.Application()
+		app.router.add_post('/nalog/inn-new-proc.json', self._nalog_ru_search_inn)
+		app.router.add_get('/nalog/static/captcha-dialog.html', self._nalog_ru_captcha_dialog)
+		app.router.add_get('/nalog/static/captcha.bin', self._nalog_ru_captcha_img)
+		app.router.add_get('/ogu/inn/', self._ogu_page)
+		app.router.add_post('/ogu/ufns/searchinn/', self._ogu_search_inn)
+
+		self._runner = web.AppRunner(app, access_log=None)
+		await self._runner.setup()
+		site = web.TCPSite(self._runner, host=self._host, port=self._port)
+		await site.start()
+		self._port = site._server.sockets[0].getsockname()[1]
+		return self
+
+	async def __aexit__(self, *args, **kwargs) -> None:
+		await self._runner.cleanup()
+
+	async def _respond(self, request: web.Request, latency: LatencyModel) -> None:
+		self.requests_num[request.path] = self.requests_num.get(request.path, 0) + 1
+		await request.read()
+		await asyncio.sleep(latency.sample())
+
+		if random.random() < self.config.throttling_rate:
+			raise web.HTTPTooManyRequests()
+		if random.random() < self.config.error_rate:
+			raise web.HTTPInternalServerError()
+
+	async def _nalog_ru_search_inn(self, request: web.Request) -> web.Response:
+		await self._respond(request=request, latency=self.config.nalog_ru_latency)
+		form_data = await request.post()
+
+		if form_data.get('c') == 'find':
+			if not form_data.get('captcha') and random.random() < self.config.captcha_rate:
+				return web.json_response({'ERRORS': {'captcha': ['Требуется ввести цифры с картинки']}}, status=400)
+
+			request_id = secrets.token_hex(16)
+			self._requests[request_id] = f'{form_data.get("fam")}|{form_data.get("bdate")}|{form_data.get("docno")}'
+			return web.json_response({'requestId': request_id, 'captchaRequired': False})
+
+		person_key = self._requests.pop(form_data.get('requestId'), None)
+		if person_key is None:
+			raise web.HTTPBadRequest()
+		if random.random() < self.config.unavailable_rate:
+			return web.json_response({'state': -1})
+		if random.random() < self.config.not_found_rate:
+			return web.json_response({'state': 0})
+		return web.json_response({'state': 1, 'inn': _get_inn(person_key=person_key)})
+
+	async def _nalog_ru_captcha_dialog(self, request: web.Request) -> web.Response:
+		await self._respond(request=request, latency=self.config.nalog_ru_latency)
+		captcha_token = secrets.token_hex(32)
+		return web.Response(text=f'<form><input type="hidden" name="captchaToken" value="{captcha_token}"/></form>',
+		                    content_type='text/html')
+
+	async def _nalog_ru_captcha_img(self, request: web.Request) -> web.Response:
+		await self._respond(request=request, latency=self.config.nalog_ru_latency)
+		return web.Response(body=self._captcha_img, content_type='image/png')
+
+	async def _ogu_page(self, request: web.Request) -> web.Response:
+		await self._respond(request=request, latency=self.config.ogu_latency)
+		stoken = secrets.token_hex(16)
+		self._stokens.add(stoken)
+
+		filler = '<!-- ' + 'x' * max(self.config.stoken_page_size - 200, 0) + ' -->'
+		return web.Response(text=f'<html><head>{filler}<script>var _stoken = \'{stoken}\';</script></head></html>',
+		                    content_type='text/html')
+
+	async def _ogu_search_inn(self, request: web.Request) -> web.Response:
+		await self._respond(request=request, latency=self.config.ogu_latency)
+		form_data = await request.post()
+		if form_data.get('_stoken') not in self._stokens:
+			raise web.HTTPForbidden()
+
+		if random.random() < self.config.not_found_rate:
+			return web.json_response({'status': 'error'})
+		return web.json_response({'status': 'success', 'individualInn': _get_inn(person_key=form_data.get('data', ''))})
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import time
+from urllib.parse import quote
+
+
+class ProxyHealth:
+	def __init__(self, latency: float = 1.0, smoothing: float = 0.2, max_consecutive_failures: int = 3,
+	             base_cooldown: float = 30.0, max_cooldown: float = 30 * 60.0) -> None:
+		self.latency = latency
+		self.success_rate = 1.0
+		self.bans_num = 0
+
+		self._smoothing = smoothing
+		self._consecutive_failures = 0
+		self._max_consecutive_failures = max_consecutive_failures
+
+		self._base_cooldown = base_cooldown
+		self._max_cooldown = max_cooldown
+		self._quarantines_num = 0
+		self.quarantined_until = 0.0
+
+	@property
+	def is_quarantined(self) -> bool:
+		return time.monotonic() < self.quarantined_until
+
+	def score(self, in_flight: int = 0) -> float:
+		return self.success_rate / (self.latency * (1 + in_flight))
+
+	def record_success(self, latency: float) -> None:
+		self.latency += self._smoothing * (latency - self.latency)
+		self.success_rate += self._smoothing * (1 - self.success_rate)
+		self._consecutive_failures = 0
+		self._quarantines_num = 0
+
+	def record_failure(self, is_banned: bool = False) -> None:
+		self.success_rate -= self._smoothing * self.success_rate
+		self._consecutive_failures += 1
+		if is_banned:
+			self.bans_num += 1
+
+		if is_banned or self._consecutive_failures >= self._max_consecutive_failures:
+			self._quarantine()
+
+	def _quarantine(self) -> None:
+		cooldown = min(self._base_cooldown * 2 ** self._quarantines_num, self._max_cooldown)
+		self._quarantines_num += 1
+		self._consecutive_failures = 0
+		self.quarantined_until = time.monotonic() + cooldown
+
+
+def _parse_proxy_line(line: str) -> str:
+	if '://' in line:
+		return line
+
+	parts = line.split(':')
+	if len(parts) == 2:
+		return f'http://{parts[0]}:{parts[1]}'
+	elif len(parts) == 4:
+		host, port, username, password = parts
+		return f'http://{quote(username, safe="")}:{quote(password, safe="")}@{host}:{port}'
+
+	raise ValueError(f'Incorrect proxy format: {line}')
+
+
+def load_proxy_urls(proxies_file: str) -> list[str]:
+	proxy_urls = []
+	with open(proxies_file, encoding='utf-8') as proxies_file_obj:
+		for line in proxies_file_obj:
+			line = line.strip()
+			if line and not line.startswith('#'):
+				proxy_urls.append(_parse_proxy_line(line))
+
+	if not proxy_urls:
+		raise ValueError(f'No proxies in {proxies_file}')
+
+	return proxy_urls
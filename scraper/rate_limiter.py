@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from typing import AsyncIterator, Callable
+
+
+class AdaptiveRateLimiter:
+	def __init__(self, name: str, is_throttling_error: Callable[[BaseException], bool],
+	             rate: float = 5.0, min_rate: float = 0.5, max_rate: float = 50.0,
+	             concurrency: int = 15, min_concurrency: int = 1, max_concurrency: int = 100,
+	             rate_step: float = 0.5, concurrency_step: int = 1, decrease_factor: float = 0.5,
+	             latency_target: float = 10.0, max_error_rate: float = 0.1,
+	             window_size: int = 50, decrease_cooldown: float = 2.0) -> None:
+		self.name = name
+		self._is_throttling_error = is_throttling_error
+
+		self._rate = rate
+		self._min_rate = min_rate
+		self._max_rate = max_rate
+		self._rate_step = rate_step
+
+		self._concurrency = concurrency
+		self._min_concurrency = min_concurrency
+		self._max_concurrency = max_concurrency
+		self._concurrency_step = concurrency_step
+
+		self._decrease_factor = decrease_factor
+		self._decrease_cooldown = decrease_cooldown
+		self._last_decrease_time = 0.0
+
+		self._latency_target = latency_target
+		self._max_error_rate = max_error_rate
+		self._outcomes: deque[bool] = deque(maxlen=window_size)
+		self._successes_since_increase = 0
+
+		self._tokens = 1.0
+		self._last_refill_time = time.monotonic()
+
+		self._in_flight = 0
+		self._slot_waiters: deque[asyncio.Future] = deque()
+
+	@property
+	def rate(self) -> float:
+		return self._rate
+
+	@property
+	def concurrency(self) -> int:
+		return self._concurrency
+
+	@property
+	def in_flight(self) -> int:
+		return self._in_flight
+
+	@property
+	def error_rate(self) -> float:
+		return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+	def stats(self) -> dict[str, float]:
+		return {
+			'rate': self._rate,
+			'concurrency': self._concurrency,
+			'in_flight': self._in_flight,
+			'error_rate': self.error_rate,
+		}
+
+	@asynccontextmanager
+	async def limit(self) -> AsyncIterator[None]:
+		await self._acquire_slot()
+		try:
+			await self._acquire_token()
+
+			start_time = time.monotonic()
+			try:
+				yield
+			except Exception as e:
+				if self._is_throttling_error(e):
+					self._on_throttled()
+				else:
+					self._outcomes.append(False)
+				raise
+			else:
+				self._on_success(latency=time.monotonic() - start_time)
+		finally:
+			self._release_slot()
+
+	async def _acquire_slot(self) -> None:
+		while self._in_flight >= self._concurrency:
+			waiter = asyncio.get_running_loop().create_future()
+			self._slot_waiters.append(waiter)
+			try:
+				await waiter
+			except asyncio.CancelledError:
+				if waiter.done() and not waiter.cancelled():
+					self._wake_slot_waiter()
+				raise
+
+		self._in_flight += 1
+
+	def _release_slot(self) -> None:
+		self._in_flight -= 1
+		self._wake_slot_waiter()
+
+	def _wake_slot_waiter(self) -> None:
+		while self._slot_waiters and self._in_flight < self._concurrency:
+			waiter = self._slot_waiters.popleft()
+			if not waiter.done():
+				waiter.set_result(None)
+				break
+
+	async def _acquire_token(self) -> None:
+		while True:
+			now = time.monotonic()
+			self._tokens = min(self._tokens + (now - self._last_refill_time) * self._rate, max(self._rate, 1.0))
+			self._last_refill_time = now
+
+			if self._tokens >= 1:
+				self._tokens -= 1
+				return
+
+			await asyncio.sleep((1 - self._tokens) / self._rate)
+
+	def _on_success(self, latency: float) -> None:
+		self._outcomes.append(True)
+		if latency > self._latency_target or self.error_rate > self._max_error_rate:
+			return
+
+		self._successes_since_increase += 1
+		if self._successes_since_increase >= self._concurrency:
+			self._successes_since_increase = 0
+			self._rate = min(self._rate + self._rate_step, self._max_rate)
+			self._concurrency = min(self._concurrency + self._concurrency_step, self._max_concurrency)
+			self._wake_slot_waiter()
+
+	def _on_throttled(self) -> None:
+		self._outcomes.append(False)
+		self._successes_since_increase = 0
+
+		now = time.monotonic()
+		if now - self._last_decrease_time < self._decrease_cooldown:
+			return
+
+		self._last_decrease_time = now
+		self._rate = max(self._rate * self._decrease_factor, self._min_rate)
+		self._concurrency = max(int(self._concurrency * self._decrease_factor), self._min_concurrency)
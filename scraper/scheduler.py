@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from logging import Logger
+
+from excel.xlsx_io import Person
+
+import asyncio
+
+from typing import AsyncIterable, Awaitable, Callable
+
+
+class SearchScheduler:
+	def __init__(self, search: Callable[[Person], Awaitable[None]], logger: Logger,
+	             workers_num: int = 15, queue_size: int | None = None) -> None:
+		if workers_num < 1:
+			raise ValueError('Workers number must be positive')
+
+		self._search = search
+		self._logger = logger
+
+		self._workers_num = workers_num
+		self._queue: asyncio.Queue[Person] = asyncio.Queue(maxsize=queue_size or workers_num * 2)
+		self._workers: list[asyncio.Task] = []
+
+		self._stop_event = asyncio.Event()
+		self._processed_num = 0
+
+	@property
+	def queue_depth(self) -> int:
+		return self._queue.qsize()
+
+	@property
+	def processed_num(self) -> int:
+		return self._processed_num
+
+	async def run(self, persons: AsyncIterable[Person]) -> None:
+		self._workers = [asyncio.create_task(self._work()) for _ in range(self._workers_num)]
+		try:
+			await self._feed(persons=persons)
+			await self._queue.join()
+		finally:
+			for worker in self._workers:
+				worker.cancel()
+			await asyncio.gather(*self._workers, return_exceptions=True)
+
+	def stop(self, drain: bool = True) -> None:
+		self._stop_event.set()
+		if not drain:
+			for worker in self._workers:
+				worker.cancel()
+
+			while not self._queue.empty():
+				self._queue.get_nowait()
+				self._queue.task_done()
+
+	async def _feed(self, persons: AsyncIterable[Person]) -> None:
+		persons_iter = aiter(persons)
+		stop_task = asyncio.create_task(self._stop_event.wait())
+		try:
+			while not self._stop_event.is_set():
+				next_person_task = asyncio.ensure_future(anext(persons_iter))
+				await asyncio.wait([next_person_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+				if not next_person_task.done():
+					next_person_task.cancel()
+					await asyncio.gather(next_person_task, return_exceptions=True)
+					break
+
+				try:
+					person = next_person_task.result()
+				except StopAsyncIteration:
+					break
+
+				put_task = asyncio.ensure_future(self._queue.put(person))
+				await asyncio.wait([put_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+				if not put_task.done():
+					put_task.cancel()
+					break
+		finally:
+			stop_task.cancel()
+			if hasattr(persons_iter, 'aclose'):
+				await persons_iter.aclose()
+
+	async def _work(self) -> None:
+		while True:
+			person = await self._queue.get()
+			try:
+				await self._search(person)
+			except Exception as e:
+				self._logger.error(f'Failed to process person (person ID - {person.person_id}): {type(e)} - {e}')
+			finally:
+				self._processed_num += 1
+				self._queue.task_done()
@@ -1,28 +1,84 @@
 from logging import Logger
-from log import InnSearcherLogger
+from log import PAYLOAD_EXTRA
 
 from excel.xlsx_io import Person
 
 import ua_generator
-from aiohttp_socks import ProxyConnector, ProxyType, ProxyError, ProxyConnectionError, ProxyTimeoutError
-from scraper.tor_proxy import get_proxy_connector
+from aiohttp_socks import ProxyError, ProxyConnectionError, ProxyTimeoutError
 
-from aiohttp import ClientSession, ClientError, ClientResponseError
+from aiohttp import ClientSession, ClientError, ClientConnectionError, ClientResponseError
 import asyncio
+from abc import ABC, abstractmethod
+from functools import partial
 
-from tenacity import retry, retry_if_exception_type, wait_fixed, wait_random, stop_after_attempt
+from tenacity import (retry, retry_if_exception_type, wait_fixed, wait_random, wait_exponential_jitter,
+                      stop_after_attempt, RetryCallState)
 
-from bs4 import BeautifulSoup
+import random
 import re
+import time
+from weakref import WeakKeyDictionary
 
-from excel.xlsx_io import output_results
+from typing import Optional
 
+from excel.results_writer import ResultsWriter
+from scraper.session import SessionManager
+from scraper.rate_limiter import AdaptiveRateLimiter
+from scraper.circuit_breaker import CircuitBreaker, CircuitOpenError, CircuitState
+from scraper.strategy import ProviderStrategy
+from scraper.cache import LookupCache
+from scraper.checkpoint import CheckpointJournal
+from scraper.single_flight import SingleFlight
+from scraper.captcha import CaptchaPool
+from scraper.metrics import METRICS
 
-_semaphore = asyncio.Semaphore(15)
 
+_THROTTLING_STATUSES = {403, 429, 503}
 
-class BaseClient:
-	def __init__(self, person: Person, session: ClientSession,
+_STOKEN_PATTERN = re.compile(rb"var _stoken = '([^']+)';")
+_STOKEN_CHUNK_SIZE = 16 * 1024
+_STOKEN_TAIL_SIZE = 256
+
+
+def is_throttling_error(e: BaseException) -> bool:
+	if isinstance(e, (ProxyError, ProxyConnectionError, ProxyTimeoutError)):
+		return True
+	return isinstance(e, ClientResponseError) and e.status in _THROTTLING_STATUSES
+
+
+def is_backend_failure(e: BaseException) -> bool:
+	if isinstance(e, (ProxyError, ProxyConnectionError, ProxyTimeoutError)):
+		return False
+	if isinstance(e, ClientResponseError):
+		return e.status >= 500 or e.status in _THROTTLING_STATUSES
+	return isinstance(e, (ClientConnectionError, asyncio.TimeoutError))
+
+
+_MAX_DEFERRALS = 3
+
+
+_throttled_wait = wait_exponential_jitter(initial=3, max=60, jitter=2)
+_error_wait = wait_fixed(1) + wait_random(min=0, max=2)
+
+
+def _wait_before_retry(retry_state: RetryCallState) -> float:
+	if is_throttling_error(retry_state.outcome.exception()):
+		return _throttled_wait(retry_state)
+	return _error_wait(retry_state)
+
+
+def _count_retry(retry_state: RetryCallState) -> None:
+	client = retry_state.args[0]
+	error = retry_state.outcome.exception()
+	METRICS.inc('retries_total', provider=client.rate_limiter.name,
+	            reason='throttled' if is_throttling_error(error) else 'error')
+
+
+class BaseClient(ABC):
+	rate_limiter: AdaptiveRateLimiter
+	circuit_breaker: CircuitBreaker
+
+	def __init__(self, person: Person, session_manager: SessionManager,
 	             headers: dict[str: str], logger: Logger) -> None:
 		self._person = person
 		self._person_id = person.person_id
@@ -45,27 +101,84 @@ class BaseClient:
 		}
 		self._headers.update(headers)
 
-		self._session = session
-		self._session.headers.update(self._headers)
+		self._session_manager = session_manager
+		self._session: Optional[ClientSession] = None
 
 		self._logger = logger
 
+	@retry(retry=retry_if_exception_type((ProxyError, ProxyConnectionError, ProxyTimeoutError, ClientError)),
+	       wait=_wait_before_retry, sleep=asyncio.sleep, stop=stop_after_attempt(10), reraise=True,
+	       before_sleep=_count_retry)
+	async def search_inn(self) -> tuple[str, str]:
+		async with self.circuit_breaker.guard(), self.rate_limiter.limit(), \
+				self._session_manager.acquire() as self._session:
+			return await self._search_inn()
+
+	@abstractmethod
+	async def _search_inn(self) -> tuple[str, str]:
+		...
+
+
+class CaptchaRequiredError(ClientResponseError):
+	pass
+
 
 class NalogRuClient(BaseClient):
-	def __init__(self, person: Person, session: ClientSession, logger: Logger) -> None:
-		self._base_url = 'https://service.nalog.ru/'
+	rate_limiter = AdaptiveRateLimiter(name='nalog.ru', is_throttling_error=is_throttling_error)
+	circuit_breaker = CircuitBreaker(name='nalog.ru', is_failure=is_backend_failure)
+	base_url = 'https://service.nalog.ru/'
+
+	_captcha_demand_period = 300.0
+	_captcha_demanded_until = 0.0
+
+	def __init__(self, person: Person, session_manager: SessionManager, logger: Logger,
+	             captcha_pool: Optional[CaptchaPool] = None) -> None:
 		self._headers = {'Origin': 'https://service.nalog.ru', 'Referer': 'https://service.nalog.ru/inn.do'}
-		super().__init__(person=person, session=session, headers=self._headers, logger=logger)
+		super().__init__(person=person, session_manager=session_manager, headers=self._headers, logger=logger)
+
+		self._captcha_pool = captcha_pool
 
 	async def _create_search_inn_request(self) -> str:
-		create_request_url = self._base_url + 'inn-new-proc.json'
-		self._logger.info(self._person.nalog_ru_form_data)
-		async with self._session.post(url=create_request_url, data=self._person.nalog_ru_form_data) as create_request_resp:
-			create_request_resp_json = await create_request_resp.json()
+		with_captcha = self._captcha_pool is not None and time.monotonic() < NalogRuClient._captcha_demanded_until
+		try:
+			return await self._post_search_inn_request(with_captcha=with_captcha)
+		except CaptchaRequiredError:
+			if self._captcha_pool is None or with_captcha:
+				raise
+
+			NalogRuClient._captcha_demanded_until = time.monotonic() + self._captcha_demand_period
+			return await self._post_search_inn_request(with_captcha=True)
+
+	async def _post_search_inn_request(self, with_captcha: bool) -> str:
+		create_request_url = self.base_url + 'inn-new-proc.json'
+		create_request_data = self._person.nalog_ru_form_data
+		if with_captcha:
+			captcha_token, captcha = await self._captcha_pool.get()
+			create_request_data = dict(create_request_data, captcha=captcha, captchaToken=captcha_token)
+
+		self._logger.info('Create search INN request data (nalog.ru | person ID: %s): %s', self._person_id,
+		                  create_request_data, extra=PAYLOAD_EXTRA)
+		async with self._session.post(url=create_request_url, data=create_request_data, headers=self._headers,
+		                              raise_for_status=False) as create_request_resp:
+			if create_request_resp.status > 400:
+				create_request_resp.raise_for_status()
 
-			self._logger.info(
-				f'Create search INN request response (nalog.ru | person ID: {self._person_id}): {create_request_resp_json}'
-			)
+			try:
+				create_request_resp_json = await create_request_resp.json(content_type=None)
+			except ValueError:
+				create_request_resp.raise_for_status()
+				raise
+
+			self._logger.info('Create search INN request response (nalog.ru | person ID: %s): %s', self._person_id,
+			                  create_request_resp_json, extra=PAYLOAD_EXTRA)
+
+			if 'captcha' in (create_request_resp_json.get('ERRORS') or {}):
+				raise CaptchaRequiredError(
+					request_info=create_request_resp.request_info,
+					history=create_request_resp.history,
+					status=create_request_resp.status,
+					message=f'Captcha required (nalog.ru | person ID: {self._person_id})'
+				)
 
 			try:
 				request_id = create_request_resp_json['requestId']
@@ -74,84 +187,114 @@ class NalogRuClient(BaseClient):
 				raise ClientResponseError(
 					request_info=create_request_resp.request_info,
 					history=create_request_resp.history,
+					status=create_request_resp.status,
 					message=f'Unexpected JSON in request ID response (nalog.ru | person ID: {self._person_id}): {type(e)} - {e}'
 				)
 
-	@retry(retry=retry_if_exception_type((ProxyError, ProxyConnectionError, ProxyTimeoutError, ClientError)),
-	       wait=wait_fixed(3) + wait_random(min=0, max=2), sleep=asyncio.sleep, stop=stop_after_attempt(10), reraise=True)
-	async def search_inn(self) -> tuple[str, str]:
-		search_inn_url = self._base_url + 'inn-new-proc.json'
+	async def _search_inn(self) -> tuple[str, str]:
+		search_inn_url = self.base_url + 'inn-new-proc.json'
+		with METRICS.time('stage_duration_seconds', provider='nalog.ru', stage='create_request'):
+			request_id = await self._create_search_inn_request()
+
 		search_inn_data = {
 			'c': 'get',
-			'requestId': await self._create_search_inn_request(),
+			'requestId': request_id,
 		}
-		async with self._session.post(url=search_inn_url, data=search_inn_data) as search_inn_resp:
-			search_inn_resp_json = await search_inn_resp.json()
+		with METRICS.time('stage_duration_seconds', provider='nalog.ru', stage='get_result'):
+			async with self._session.post(url=search_inn_url, data=search_inn_data, headers=self._headers) as search_inn_resp:
+				search_inn_resp_json = await search_inn_resp.json()
 
-			self._logger.info(f'Search INN response (nalog.ru | person ID: {self._person_id}): {search_inn_resp_json}')
+		self._logger.info('Search INN response (nalog.ru | person ID: %s): %s', self._person_id, search_inn_resp_json,
+		                  extra=PAYLOAD_EXTRA)
 
-			try:
-				inn = str()
-				search_status = str()
-				search_inn_result_state = search_inn_resp_json['state']
-				if search_inn_result_state == 0:
-					search_status = 'ИНН не найден'
-				elif search_inn_result_state == 1:
-					inn = search_inn_resp_json['inn']
-					search_status = 'Успешно'
-				elif search_inn_result_state == -1:
-					raise ClientResponseError(
-						request_info=search_inn_resp.request_info,
-						history=search_inn_resp.history,
-						message=f'nalog.ru unavailable (person ID: {self._person_id})'
-					)
-
-				return inn, search_status
-			except KeyError as e:
+		try:
+			inn = str()
+			search_status = str()
+			search_inn_result_state = search_inn_resp_json['state']
+			if search_inn_result_state == 0:
+				search_status = 'ИНН не найден'
+			elif search_inn_result_state == 1:
+				inn = search_inn_resp_json['inn']
+				search_status = 'Успешно'
+			elif search_inn_result_state == -1:
 				raise ClientResponseError(
 					request_info=search_inn_resp.request_info,
 					history=search_inn_resp.history,
-					message=f'Unexpected JSON in search INN response (nalog.ru | person ID: {self._person_id}) - {e}'
+					status=503,
+					message=f'nalog.ru unavailable (person ID: {self._person_id})'
 				)
 
+			return inn, search_status
+		except KeyError as e:
+			raise ClientResponseError(
+				request_info=search_inn_resp.request_info,
+				history=search_inn_resp.history,
+				message=f'Unexpected JSON in search INN response (nalog.ru | person ID: {self._person_id}) - {e}'
+			)
+
 
 class OGUClient(BaseClient):
-	def __init__(self, person: Person, session: ClientSession, logger: Logger) -> None:
-		self._base_url = 'https://oplatagosuslug.ru/'
+	rate_limiter = AdaptiveRateLimiter(name='OGU', is_throttling_error=is_throttling_error)
+	circuit_breaker = CircuitBreaker(name='OGU', is_failure=is_backend_failure)
+	base_url = 'https://oplatagosuslug.ru/'
+
+	_stokens: WeakKeyDictionary[ClientSession, str] = WeakKeyDictionary()
+
+	def __init__(self, person: Person, session_manager: SessionManager, logger: Logger) -> None:
 		self._headers = {'Origin': 'https://oplatagosuslug.ru', 'Referer': 'https://oplatagosuslug.ru/inn/'}
-		super().__init__(person=person, session=session, headers=self._headers, logger=logger)
+		super().__init__(person=person, session_manager=session_manager, headers=self._headers, logger=logger)
 
 	async def _get_stoken(self) -> str:
-		async with self._session.get(url=self._base_url + 'inn/') as get_stoken_resp:
-			ogu_inn_service_page = await get_stoken_resp.text()
-
-			ogu_inn_service_page_soup = BeautifulSoup(ogu_inn_service_page, features='html.parser')
-			page_scripts = ogu_inn_service_page_soup.find_all(name='script', attrs={'type': 'text/javascript'})
-			for script in page_scripts:
-				script_text = script.get_text()
-				stoken_pattern = re.compile(r"var _stoken = '([^']+)';")
-				match = stoken_pattern.search(script_text)
+		stoken = OGUClient._stokens.get(self._session)
+		if stoken:
+			return stoken
+
+		with METRICS.time('stage_duration_seconds', provider='OGU', stage='stoken_fetch'):
+			stoken = await self._fetch_stoken()
+		OGUClient._stokens[self._session] = stoken
+		return stoken
+
+	async def _fetch_stoken(self) -> str:
+		async with self._session.get(url=self.base_url + 'inn/', headers=self._headers) as get_stoken_resp:
+			page_tail = b''
+			async for chunk in get_stoken_resp.content.iter_chunked(_STOKEN_CHUNK_SIZE):
+				page_tail += chunk
+				match = _STOKEN_PATTERN.search(page_tail)
 				if match:
-					stoken = match.group(1)
-					return stoken
-			else:
-				raise ClientResponseError(
-					request_info=get_stoken_resp.request_info,
-					history=get_stoken_resp.history,
-					message=f'No stoken was found'
-				)
+					return match.group(1).decode('utf-8')
 
-	@retry(retry=retry_if_exception_type((ProxyError, ProxyConnectionError, ProxyTimeoutError, ClientError)),
-	       wait=wait_fixed(3) + wait_random(min=0, max=2), sleep=asyncio.sleep, stop=stop_after_attempt(10), reraise=True)
-	async def search_inn(self) -> tuple[str, str]:
+				page_tail = page_tail[-_STOKEN_TAIL_SIZE:]
+
+			raise ClientResponseError(
+				request_info=get_stoken_resp.request_info,
+				history=get_stoken_resp.history,
+				message=f'No stoken was found'
+			)
+
+	def _invalidate_stoken(self, stoken: str) -> None:
+		if OGUClient._stokens.get(self._session) == stoken:
+			del OGUClient._stokens[self._session]
+
+	async def _search_inn(self) -> tuple[str, str]:
+		stoken = await self._get_stoken()
 		search_inn_data = {
 			'data': self._person.ogu_form_data,
-			'_stoken': await self._get_stoken()
+			'_stoken': stoken
 		}
-		async with self._session.post(url=self._base_url + 'ufns/searchinn/', data=search_inn_data) as search_inn_resp:
+		try:
+			with METRICS.time('stage_duration_seconds', provider='OGU', stage='search'):
+				return await self._post_search_inn(search_inn_data=search_inn_data)
+		except (ClientResponseError, ValueError):
+			self._invalidate_stoken(stoken=stoken)
+			raise
+
+	async def _post_search_inn(self, search_inn_data: dict[str, str]) -> tuple[str, str]:
+		async with self._session.post(url=self.base_url + 'ufns/searchinn/', data=search_inn_data,
+		                              headers=self._headers) as search_inn_resp:
 			search_inn_resp_json = await search_inn_resp.json()
 
-			self._logger.info(f'Search INN response (OGU | person ID: {self._person_id}): {search_inn_resp_json}')
+			self._logger.info('Search INN response (OGU | person ID: %s): %s', self._person_id, search_inn_resp_json,
+			                  extra=PAYLOAD_EXTRA)
 
 			try:
 				if search_inn_resp_json['status'] == 'success':
@@ -170,44 +313,110 @@ class OGUClient(BaseClient):
 				)
 
 
-async def search_inn_(person: Person, logger: Logger, output_file: str) -> None:
-	async with _semaphore:
-		inn = str()
-
-		# async with ProxyConnector(proxy_type=ProxyType.HTTP, host='94.103.188.163', port='13811',
-		#                           username='yfy5n4', password='s4SsUv') as proxy_conn:
-		proxy_conn = TCPConnector()
-		async with ClientSession(connector=proxy_conn, raise_for_status=True) as session:
-			try:
-				inn, search_status = await NalogRuClient(person=person, session=session, logger=logger).search_inn()
-			except Exception as e:
-				search_status = 'Ошибка'
-
-				logger.error(f'Failed to search INN (nalog.ru | person ID - {person.person_id}): {type(e)} - {e}')
-				print(f'Failed to search INN (nalog.ru | person ID - {person.person_id}): {type(e)} - {e}')
-
-			if not inn:
-				try:
-					inn, search_status = await OGUClient(person=person, session=session, logger=logger).search_inn()
-				except Exception as e:
-					search_status = 'Ошибка'
-
-					logger.error(f'Failed to search INN (OGU | person ID - {person.person_id}): {type(e)} - {e}')
-					print(f'Failed to search INN (OGU | person ID - {person.person_id}): {type(e)} - {e}')
-
-		person.inn = inn
-		person.inn_search_status = search_status
-
+async def _search_provider(client_cls: type[BaseClient], provider_name: str, person: Person,
+                           session_manager: SessionManager, logger: Logger, **client_kwargs) -> tuple[str, str]:
+	try:
+		inn, search_status = await client_cls(
+			person=person, session_manager=session_manager, logger=logger, **client_kwargs
+		).search_inn()
+		METRICS.inc('lookups_total', provider=provider_name, status=search_status)
+		return inn, search_status
+	except CircuitOpenError as e:
+		METRICS.inc('lookups_total', provider=provider_name, status='circuit_open')
+		logger.info(f'Skipped search INN ({provider_name} | person ID - {person.person_id}): {e}')
+		return str(), 'Ошибка'
+	except Exception as e:
+		METRICS.inc('lookups_total', provider=provider_name, status='Ошибка')
+		logger.error(f'Failed to search INN ({provider_name} | person ID - {person.person_id}): {type(e)} - {e}')
+		print(f'Failed to search INN ({provider_name} | person ID - {person.person_id}): {type(e)} - {e}')
+		return str(), 'Ошибка'
+
+
+async def _lookup_inn(person: Person, session_manager: SessionManager, provider_strategy: ProviderStrategy,
+                      logger: Logger, lookup_cache: Optional[LookupCache] = None,
+                      captcha_pool: Optional[CaptchaPool] = None) -> tuple[str, str]:
+	cached_result = None
+	if lookup_cache:
+		try:
+			cached_result = await lookup_cache.get(person=person)
+		except Exception as e:
+			logger.error(f'Failed to get cached search INN result (person ID - {person.person_id}): {type(e)} - {e}')
+		METRICS.inc('cache_lookups_total', result='hit' if cached_result else 'miss')
+	if cached_result:
+		logger.info(f'Search INN result from cache (person ID - {person.person_id}): {cached_result[1]}')
+		return cached_result
+
+	searches = [
+		partial(_search_provider, NalogRuClient, 'nalog.ru', person=person, session_manager=session_manager,
+		        logger=logger, captcha_pool=captcha_pool),
+		partial(_search_provider, OGUClient, 'OGU', person=person, session_manager=session_manager, logger=logger),
+	]
+	circuit_breakers = (NalogRuClient.circuit_breaker, OGUClient.circuit_breaker)
+	for deferrals_num in range(_MAX_DEFERRALS + 1):
+		inn, search_status = await provider_strategy.search(searches=searches)
+		if search_status != 'Ошибка' or deferrals_num == _MAX_DEFERRALS or any(
+			circuit_breaker.state != CircuitState.OPEN for circuit_breaker in circuit_breakers
+		):
+			break
+
+		retry_after = min(circuit_breaker.retry_after for circuit_breaker in circuit_breakers)
+		logger.info(f'All providers are unavailable, search INN deferred for {retry_after:.1f} s '
+		            f'(person ID - {person.person_id})')
+		await asyncio.sleep(retry_after + random.uniform(0, 1))
+
+	if lookup_cache:
+		try:
+			await lookup_cache.set(person=person, inn=inn, search_status=search_status)
+		except Exception as e:
+			logger.error(f'Failed to cache search INN result (person ID - {person.person_id}): {type(e)} - {e}')
+
+	return inn, search_status
+
+
+async def lookup_person(person: Person, session_manager: SessionManager, provider_strategy: ProviderStrategy,
+                        logger: Logger, lookup_cache: Optional[LookupCache] = None,
+                        single_flight: Optional[SingleFlight] = None, captcha_pool: Optional[CaptchaPool] = None) -> None:
+	lookup_inn = partial(
+		_lookup_inn, person=person, session_manager=session_manager, provider_strategy=provider_strategy,
+		logger=logger, lookup_cache=lookup_cache, captcha_pool=captcha_pool
+	)
+	with METRICS.time('lookup_duration_seconds'):
+		if single_flight:
+			inn, search_status = await single_flight.do(key=person.identity_key, func=lookup_inn)
+		else:
+			inn, search_status = await lookup_inn()
+	METRICS.inc('persons_total', status=search_status)
+
+	person.inn = inn
+	person.inn_search_status = search_status
+
+
+async def search_inn_(person: Person, session_manager: SessionManager, provider_strategy: ProviderStrategy,
+                      logger: Logger, results_writer: ResultsWriter, lookup_cache: Optional[LookupCache] = None,
+                      checkpoint: Optional[CheckpointJournal] = None,
+                      single_flight: Optional[SingleFlight] = None, captcha_pool: Optional[CaptchaPool] = None) -> None:
+	await lookup_person(
+		person=person, session_manager=session_manager, provider_strategy=provider_strategy, logger=logger,
+		lookup_cache=lookup_cache, single_flight=single_flight, captcha_pool=captcha_pool
+	)
+
+	try:
+		await results_writer.put(checked_person=person)
+	except Exception as e:
+		logger.error(f'Failed to output results (person ID - {person.person_id}): {type(e)} - {e} | Results: {person.to_json()}')
+		print(f'Failed to output results (person ID - {person.person_id}): {type(e)} - {e} | Results: {person.to_json()}')
+
+	if checkpoint:
 		try:
-			await asyncio.to_thread(output_results, output_excel_file=output_file, checked_person=checked_person)
+			await checkpoint.record(person=person)
 		except Exception as e:
-			logger.error(f'Failed to output results (person ID - {person.person_id}): {type(e)} - {e} | Results: {person.to_json()}')
-			print(f'Failed to output results (person ID - {person.person_id}): {type(e)} - {e} | Results: {person.to_json()}')
+			logger.error(f'Failed to record checkpoint (person ID - {person.person_id}): {type(e)} - {e}')
 
 
 if __name__ == '__main__':
 	from log import InnSearcherLogger
 	from excel.xlsx_io import get_persons_list
+	from scraper.scheduler import SearchScheduler
 
 	import time
 
@@ -216,17 +425,21 @@ if __name__ == '__main__':
 		logger = InnSearcherLogger()
 
 		persons_list = get_persons_list('../excel/input/persons_table.xlsx') * 5
-		tasks = [search_inn_(person=person, logger=logger, output_file='../excel/output/test.xlsx') for person in persons_list]
 
 		print('-----START----')
 		start_time = time.time()
 
-		tasks_count = 0
-		for task in asyncio.as_completed(tasks):
-			await task
+		async def iter_persons():
+			for person in persons_list:
+				yield person
+
+		async with SessionManager() as session_manager, \
+				ResultsWriter(output_excel_file='../excel/output/test.xlsx') as results_writer:
+			async def search(person):
+				await search_inn_(person=person, session_manager=session_manager, provider_strategy=ProviderStrategy(),
+				                  logger=logger, results_writer=results_writer)
 
-			tasks_count += 1
-			print(f'Task {tasks_count}')
+			await SearchScheduler(search=search, logger=logger, workers_num=15).run(persons=iter_persons())
 
 		print(f'Time: {time.time() - start_time}')
 
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+from excel.xlsx_io import Person, normalize_records
+from scraper.scraper import NalogRuClient, OGUClient
+from scraper.metrics import METRICS, MetricsRegistry
+
+from aiohttp import web
+
+import asyncio
+import json
+from logging import Logger
+
+from typing import Any, Awaitable, Callable
+
+
+def _dumps(obj: Any) -> str:
+	return json.dumps(obj, ensure_ascii=False)
+
+
+class LookupService:
+	def __init__(self, lookup: Callable[[Person], Awaitable[None]], logger: Logger, host: str = '127.0.0.1',
+	             port: int = 8080, max_concurrency: int = 15, max_batch_size: int = 1000,
+	             registry: MetricsRegistry = METRICS) -> None:
+		self._lookup = lookup
+		self._logger = logger
+		self._host = host
+		self._port = port
+		self._max_batch_size = max_batch_size
+		self._registry = registry
+
+		self._semaphore = asyncio.Semaphore(max_concurrency)
+		self._tasks: set[asyncio.Task] = set()
+		self._stop_event = asyncio.Event()
+		self._processed_num = 0
+		self._runner: web.AppRunner | None = None
+
+	@property
+	def in_flight_num(self) -> int:
+		return len(self._tasks)
+
+	@property
+	def processed_num(self) -> int:
+		return self._processed_num
+
+	async def __aenter__(self) -> 'LookupService':
+		app = web.Application()
+		app.router.add_post('/lookup', self._post_lookup)
+		app.router.add_post('/lookup/batch', self._post_lookup_batch)
+		app.router.add_get('/health', self._get_health)
+		app.router.add_get('/metrics', self._get_metrics)
+
+		self._runner = web.AppRunner(app, access_log=None)
+		await self._runner.setup()
+		await web.TCPSite(self._runner, host=self._host, port=self._port).start()
+		self._logger.info(f'Lookup service is listening on http://{self._host}:{self._port}')
+		return self
+
+	async def __aexit__(self, *args, **kwargs) -> None:
+		await self._runner.cleanup()
+
+	async def serve_forever(self) -> None:
+		await self._stop_event.wait()
+
+	def stop(self, drain: bool = True) -> None:
+		self._stop_event.set()
+		if not drain:
+			for task in self._tasks:
+				task.cancel()
+
+	def _start_lookup(self, record_idx: int, person: Person) -> asyncio.Task[tuple[int, Person]]:
+		task = asyncio.create_task(self._run_lookup(record_idx=record_idx, person=person))
+		self._tasks.add(task)
+		task.add_done_callback(self._tasks.discard)
+		return task
+
+	async def _run_lookup(self, record_idx: int, person: Person) -> tuple[int, Person]:
+		async with self._semaphore:
+			try:
+				await self._lookup(person)
+			except Exception as e:
+				self._logger.error(f'Failed to search INN (person ID - {person.person_id}): {type(e)} - {e}')
+				person.inn_search_status = 'Ошибка'
+
+		self._processed_num += 1
+		return record_idx, person
+
+	async def _read_json(self, request: web.Request) -> Any:
+		if self._stop_event.is_set():
+			raise web.HTTPServiceUnavailable(text='Lookup service is stopping')
+		try:
+			return await request.json()
+		except ValueError:
+			raise web.HTTPBadRequest(text='Request body must be JSON')
+
+	async def _post_lookup(self, request: web.Request) -> web.Response:
+		person_json = await self._read_json(request)
+		if not isinstance(person_json, dict):
+			raise web.HTTPBadRequest(text='Expected a JSON object with a single person, use /lookup/batch for lists')
+
+		self._registry.inc('service_requests_total', endpoint='lookup')
+		persons, rejects = normalize_records(records=[person_json])
+		if rejects:
+			return web.json_response({'error': rejects[0][1]}, status=400, dumps=_dumps)
+
+		_, person = await self._start_lookup(*persons[0])
+		return web.json_response(person.to_json(), dumps=_dumps)
+
+	async def _post_lookup_batch(self, request: web.Request) -> web.StreamResponse:
+		persons_json = await self._read_json(request)
+		if not isinstance(persons_json, list):
+			raise web.HTTPBadRequest(text='Expected a JSON array of persons')
+		if len(persons_json) > self._max_batch_size:
+			raise web.HTTPRequestEntityTooLarge(max_size=self._max_batch_size, actual_size=len(persons_json),
+			                                    text=f'Batch is limited to {self._max_batch_size} persons')
+
+		self._registry.inc('service_requests_total', endpoint='lookup_batch')
+		persons, rejects = normalize_records(records=persons_json)
+
+		response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson; charset=utf-8'})
+		await response.prepare(request)
+
+		tasks = [self._start_lookup(record_idx=record_idx, person=person) for record_idx, person in persons]
+		try:
+			for record_idx, reason in rejects:
+				await response.write(f'{_dumps({"index": record_idx, "error": reason})}\n'.encode('utf-8'))
+
+			for task in asyncio.as_completed(tasks):
+				record_idx, person = await task
+				await response.write(f'{_dumps({"index": record_idx, **person.to_json()})}\n'.encode('utf-8'))
+		except (ConnectionResetError, asyncio.CancelledError) as e:
+			self._logger.warning(f'Batch lookup was interrupted: {type(e)} - {e}')
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+			raise
+
+		await response.write_eof()
+		return response
+
+	async def _get_health(self, request: web.Request) -> web.Response:
+		return web.json_response({
+			'status': 'stopping' if self._stop_event.is_set() else 'ok',
+			'in_flight': self.in_flight_num,
+			'processed': self.processed_num,
+			'circuits': {
+				client_cls.circuit_breaker.name: client_cls.circuit_breaker.state.value
+				for client_cls in (NalogRuClient, OGUClient)
+			},
+		}, dumps=_dumps)
+
+	async def _get_metrics(self, request: web.Request) -> web.Response:
+		return web.Response(text=self._registry.render_prometheus(), content_type='text/plain', charset='utf-8')
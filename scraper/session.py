@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+from aiohttp import BaseConnector, ClientSession, ClientTimeout, TCPConnector
+from aiohttp_socks import ProxyConnector
+
+from scraper.proxy_pool import ProxyHealth
+
+import asyncio
+from contextlib import asynccontextmanager
+from itertools import count
+import time
+
+from typing import AsyncIterator, Callable, Optional, Sequence
+
+
+class SessionExit:
+	def __init__(self, session: ClientSession, proxy_url: Optional[str] = None) -> None:
+		self.session = session
+		self.proxy_url = proxy_url
+		self.in_flight = 0
+		self.health = ProxyHealth()
+
+
+class SessionManager:
+	def __init__(self, proxy_urls: Optional[Sequence[str]] = None, limit: int = 100, limit_per_host: int = 15,
+	             keepalive_timeout: float = 60.0, timeout: float = 60.0,
+	             is_ban_error: Optional[Callable[[BaseException], bool]] = None) -> None:
+		self._proxy_urls = None if proxy_urls is None else list(proxy_urls)
+		self._is_ban_error = is_ban_error or (lambda e: False)
+		self._limit = limit
+		self._limit_per_host = limit_per_host
+		self._keepalive_timeout = keepalive_timeout
+		self._timeout = timeout
+
+		self._exits: list[SessionExit] = []
+		self._exits_added = asyncio.Event()
+		self._exits_error: Optional[Exception] = None
+		self._exit_counter = count()
+		self._is_started = False
+
+	@property
+	def exits(self) -> list[SessionExit]:
+		return list(self._exits)
+
+	async def __aenter__(self) -> 'SessionManager':
+		self._is_started = True
+		self.add_exits(proxy_urls=[None] if self._proxy_urls is None else self._proxy_urls)
+		return self
+
+	async def __aexit__(self, *args, **kwargs) -> None:
+		self._is_started = False
+		for session_exit in self._exits:
+			await session_exit.session.close()
+		self._exits = []
+
+	def add_exits(self, proxy_urls: Sequence[Optional[str]]) -> None:
+		for proxy_url in proxy_urls:
+			self._exits.append(SessionExit(session=self._create_session(proxy_url=proxy_url), proxy_url=proxy_url))
+
+		if self._exits:
+			self._exits_added.set()
+
+	def fail_exits(self, error: Exception) -> None:
+		self._exits_error = error
+		self._exits_added.set()
+
+	@asynccontextmanager
+	async def acquire(self) -> AsyncIterator[ClientSession]:
+		if not self._is_started:
+			raise RuntimeError('Session manager is not started')
+
+		await self._exits_added.wait()
+		if not self._exits:
+			raise RuntimeError(f'No session exits available: {self._exits_error}')
+
+		session_exit = self._select_exit()
+		session_exit.in_flight += 1
+		start_time = time.monotonic()
+		try:
+			yield session_exit.session
+		except Exception as e:
+			session_exit.health.record_failure(is_banned=self._is_ban_error(e))
+			raise
+		else:
+			session_exit.health.record_success(latency=time.monotonic() - start_time)
+		finally:
+			session_exit.in_flight -= 1
+
+	def _select_exit(self) -> SessionExit:
+		offset = next(self._exit_counter) % len(self._exits)
+		rotated_exits = self._exits[offset:] + self._exits[:offset]
+
+		healthy_exits = [session_exit for session_exit in rotated_exits if not session_exit.health.is_quarantined]
+		if not healthy_exits:
+			return min(rotated_exits, key=lambda session_exit: session_exit.health.quarantined_until)
+
+		return max(healthy_exits, key=lambda session_exit: session_exit.health.score(in_flight=session_exit.in_flight))
+
+	def _create_session(self, proxy_url: Optional[str] = None) -> ClientSession:
+		limit_per_exit = max(self._limit // max(len(self._proxy_urls or []), 1), 1)
+		connector_kwargs = {
+			'limit': limit_per_exit,
+			'limit_per_host': min(self._limit_per_host, limit_per_exit),
+			'keepalive_timeout': self._keepalive_timeout,
+		}
+		if proxy_url:
+			connector: BaseConnector = ProxyConnector.from_url(proxy_url, **connector_kwargs)
+		else:
+			connector = TCPConnector(ttl_dns_cache=300, **connector_kwargs)
+
+		return ClientSession(connector=connector, timeout=ClientTimeout(total=self._timeout), raise_for_status=True)
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from excel.xlsx_io import Person
+
+from argparse import ArgumentTypeError
+from hashlib import sha256
+import os
+
+from typing import AsyncIterable, AsyncIterator, Sequence, TypeVar
+
+
+T = TypeVar('T')
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+	try:
+		shard_index, shards_num = map(int, shard.split('/'))
+	except ValueError:
+		raise ArgumentTypeError(f'Incorrect shard (expected I/K, e.g. 0/4): {shard}')
+
+	if not 0 <= shard_index < shards_num:
+		raise ArgumentTypeError(f'Shard index must be in [0, {shards_num}): {shard}')
+
+	return shard_index, shards_num
+
+
+def get_shard_index(person: Person, shards_num: int) -> int:
+	return int.from_bytes(sha256(person.person_id.encode('utf-8')).digest()[:8], 'big') % shards_num
+
+
+def get_shard_file(file: str, shard_index: int, shards_num: int) -> str:
+	file_stem, file_ext = os.path.splitext(file)
+	return f'{file_stem}.shard-{shard_index}-of-{shards_num}{file_ext}'
+
+
+def split_shard(items: Sequence[T], shard_index: int, shards_num: int) -> list[T]:
+	if len(items) < shards_num:
+		return list(items)
+	return list(items[shard_index::shards_num])
+
+
+async def shard_persons(persons: AsyncIterable[Person], shard_index: int, shards_num: int) -> AsyncIterator[Person]:
+	async for person in persons:
+		if get_shard_index(person=person, shards_num=shards_num) == shard_index:
+			yield person
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import asyncio
+
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+
+T = TypeVar('T')
+
+
+class SingleFlight(Generic[T]):
+	def __init__(self) -> None:
+		self._in_flight: dict[Hashable, asyncio.Future[T]] = {}
+		self._shared_num = 0
+
+	@property
+	def in_flight_num(self) -> int:
+		return len(self._in_flight)
+
+	@property
+	def shared_num(self) -> int:
+		return self._shared_num
+
+	async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+		while key in self._in_flight:
+			in_flight_future = self._in_flight[key]
+			try:
+				result = await asyncio.shield(in_flight_future)
+				self._shared_num += 1
+				return result
+			except asyncio.CancelledError:
+				if not in_flight_future.cancelled():
+					raise
+
+		future = asyncio.get_running_loop().create_future()
+		future.add_done_callback(lambda done_future: done_future.cancelled() or done_future.exception())
+		self._in_flight[key] = future
+		try:
+			result = await func()
+		except asyncio.CancelledError:
+			future.cancel()
+			raise
+		except BaseException as e:
+			future.set_exception(e)
+			raise
+		else:
+			future.set_result(result)
+			return result
+		finally:
+			del self._in_flight[key]
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from scraper.metrics import quantile
+
+import asyncio
+import time
+from collections import deque
+from enum import Enum
+
+from typing import Awaitable, Callable, Optional, Sequence
+
+
+SearchResult = tuple[str, str]
+ProviderSearch = Callable[[], Awaitable[SearchResult]]
+
+_SEARCH_STATUS_RANKS = {'Успешно': 2, 'ИНН не найден': 1}
+
+
+class StrategyMode(str, Enum):
+	SEQUENTIAL = 'sequential'
+	RACE = 'race'
+	HEDGED = 'hedged'
+
+
+class LatencyTracker:
+	def __init__(self, window_size: int = 200, min_samples: int = 20) -> None:
+		self._latencies: deque[float] = deque(maxlen=window_size)
+		self._min_samples = min_samples
+
+	def add(self, latency: float) -> None:
+		self._latencies.append(latency)
+
+	def percentile(self, q: float) -> Optional[float]:
+		if len(self._latencies) < self._min_samples:
+			return None
+
+		return quantile(sorted(self._latencies), q)
+
+
+def _best_result(results: Sequence[SearchResult]) -> SearchResult:
+	return max(results, key=lambda result: _SEARCH_STATUS_RANKS.get(result[1], 0))
+
+
+class ProviderStrategy:
+	def __init__(self, mode: StrategyMode = StrategyMode.SEQUENTIAL,
+	             hedge_percentile: float = 0.95, hedge_default_delay: float = 10.0) -> None:
+		self.mode = mode
+		self._hedge_percentile = hedge_percentile
+		self._hedge_default_delay = hedge_default_delay
+		self._primary_latencies = LatencyTracker()
+
+	@property
+	def hedge_delay(self) -> float:
+		hedge_delay = self._primary_latencies.percentile(self._hedge_percentile)
+		return self._hedge_default_delay if hedge_delay is None else hedge_delay
+
+	async def search(self, searches: Sequence[ProviderSearch]) -> SearchResult:
+		if not searches:
+			raise ValueError('No providers to search with')
+
+		if self.mode == StrategyMode.RACE:
+			return await self._search_race(searches=searches)
+		elif self.mode == StrategyMode.HEDGED:
+			return await self._search_hedged(searches=searches)
+		return await self._search_sequential(searches=searches)
+
+	async def _search_primary(self, search: ProviderSearch) -> SearchResult:
+		start_time = time.monotonic()
+		inn, search_status = await search()
+		if search_status != 'Ошибка':
+			self._primary_latencies.add(time.monotonic() - start_time)
+
+		return inn, search_status
+
+	async def _search_sequential(self, searches: Sequence[ProviderSearch]) -> SearchResult:
+		inn, search_status = await self._search_primary(search=searches[0])
+		for search in searches[1:]:
+			if inn:
+				break
+			inn, search_status = await search()
+
+		return inn, search_status
+
+	async def _search_race(self, searches: Sequence[ProviderSearch]) -> SearchResult:
+		search_tasks = [asyncio.create_task(self._search_primary(search=searches[0]))]
+		search_tasks += [asyncio.create_task(search()) for search in searches[1:]]
+		return await self._wait_first_inn(search_tasks=search_tasks)
+
+	async def _search_hedged(self, searches: Sequence[ProviderSearch]) -> SearchResult:
+		search_tasks = []
+		pending = set()
+		results = []
+		try:
+			for search_idx, search in enumerate(searches):
+				search_task = asyncio.create_task(self._search_primary(search=search) if search_idx == 0 else search())
+				search_tasks.append(search_task)
+				pending.add(search_task)
+				if search_idx == len(searches) - 1:
+					break
+
+				hedge_time = time.monotonic() + self.hedge_delay
+				while pending:
+					done, pending = await asyncio.wait(
+						pending, timeout=max(hedge_time - time.monotonic(), 0), return_when=asyncio.FIRST_COMPLETED
+					)
+					if not done:
+						break
+
+					for done_task in done:
+						inn, search_status = done_task.result()
+						if inn:
+							for search_task in pending:
+								search_task.cancel()
+							await asyncio.gather(*pending, return_exceptions=True)
+							return inn, search_status
+						results.append((inn, search_status))
+		except BaseException:
+			for search_task in search_tasks:
+				search_task.cancel()
+			await asyncio.gather(*search_tasks, return_exceptions=True)
+			raise
+
+		return await self._wait_first_inn(search_tasks=list(pending), results=results)
+
+	@staticmethod
+	async def _wait_first_inn(search_tasks: list[asyncio.Task],
+	                          results: Optional[list[SearchResult]] = None) -> SearchResult:
+		results = list(results or [])
+		try:
+			for search_task in asyncio.as_completed(search_tasks):
+				inn, search_status = await search_task
+				if inn:
+					return inn, search_status
+				results.append((inn, search_status))
+		finally:
+			for search_task in search_tasks:
+				search_task.cancel()
+			await asyncio.gather(*search_tasks, return_exceptions=True)
+
+		return _best_result(results)